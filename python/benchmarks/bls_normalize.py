@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""Benchmark for BLS.parse_series & BLS.normalize against the per-observation parsing and string-based
+   value, date & FIPS handling they replaced in BLS.get_series & transform_bls.
+   Builds a synthetic API payload (national & state series) and metro frame the size & shape of the full
+   aggregated LAUS data (1990 to date), so it runs without API keys or network access.
+
+   Example:
+       $ python3 python/benchmarks/bls_normalize.py --repeat 5
+"""
+
+# -- Imports --------------------------------------------------------------------------------
+import argparse, itertools, time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from probitaspy.ppy_api import BLS
+
+# -- Data -----------------------------------------------------------------------------------
+
+laus_series_names = {'3' : 'Unemployment Rate', '4' : 'Unemployment', '5' : 'Employment', '6' : 'Labor Force'}
+
+def laus_payload(start_year: int = 1990, states: int = 53, seed: int = 0) -> dict:
+    """timeseries/data JSON as the BLS API returns it for the national & state series: string values,
+       M01-M13 periods (M13 is the annual average), footnotes as a list of {code, text} or [{}]
+    """
+    rng = np.random.default_rng(seed)
+    years = [str(y) for y in range(start_year, datetime.now().year + 1)]
+    periods = [f'M{m:02d}' for m in range(1, 14)]
+    series_ids = [f'LNS1400000{n}' for n in laus_series_names] + \
+                 [f'LASST{str(s).zfill(2)}000000000000{n}' for s in range(1, states + 1) for n in laus_series_names]
+    preliminary = [{'code' : 'P', 'text' : 'Preliminary.'}]
+
+    series = []
+    for series_id in series_ids:
+        values = rng.random(len(years) * len(periods)) * 1000
+        data = [{'year' : y, 'period' : p, 'value' : f'{v:.1f}', 'footnotes' : preliminary if y == years[-1] else [{}]}
+                for (y, p), v in zip(itertools.product(years, periods), values)]
+        series.append({'seriesID' : series_id, 'data' : data})
+    # BLS marks unavailable values with '-' & '(n)'
+    series[-1]['data'][0]['value'] = '-'
+    series[-1]['data'][1]['value'] = '(n)'
+    return({'status' : 'REQUEST_SUCCEEDED', 'Results' : {'series' : series}})
+
+def msa_frame(start_year: int = 1990, states: int = 53, metro_areas: int = 390, seed: int = 0) -> pd.DataFrame:
+    """Metro rows as process_msa leaves them: string FIPS codes, integer year & month, float values
+       with the workbook's '-' marker
+    """
+    rng = np.random.default_rng(seed)
+    years = np.arange(start_year, datetime.now().year + 1)
+    periods = pd.MultiIndex.from_product([years, np.arange(1, 13)], names = ['year', 'month']).to_frame(index = False)
+
+    state_fips = [str(s).zfill(2) for s in range(1, states + 1)]
+    frame = pd.DataFrame({
+        'fips_state' : [state_fips[i % states] for i in range(metro_areas)],
+        'fips_area' : [str(10000 + 80 * i) for i in range(metro_areas)],
+        'name_area' : [f'Area {i}' for i in range(metro_areas)]
+        })
+    frame = frame.merge(pd.DataFrame({'laus_series_name' : list(laus_series_names.values())}), how = 'cross')
+    frame = frame.merge(periods, how = 'cross')
+    frame['geo_scope'] = 'Metropolitan Area'
+    frame['name_state'] = 'State ' + frame['fips_state']
+    frame['type_area'] = 'MSA'
+    frame['flags'] = ''
+    frame['series_id'] = 'LAUMT' + frame['fips_state'] + frame['fips_area'] + frame['laus_series_name'].str[:3]
+    frame['value'] = pd.Series(rng.random(len(frame)) * 1000, dtype = 'object')
+    frame.loc[frame.index[::97], 'value'] = '-'
+    return(frame)
+
+def label_api(df: pd.DataFrame) -> pd.DataFrame:
+    """Geography & measure labels of the API rows, the same for both implementations
+    """
+    series_id = df['series_id'].astype('str')
+    national = series_id.str.startswith('LNS')
+    df['fips_state'] = np.where(national, '99', series_id.str[5:7])
+    df['geo_scope'] = np.where(national, 'National', 'State')
+    df['name_state'] = 'State ' + df['fips_state']
+    df['laus_series_name'] = series_id.str[-1:].map(laus_series_names)
+    df['type_area'] = ''
+    df['flags'] = ''
+    return(df)
+
+# -- Implementations ------------------------------------------------------------------------
+
+def legacy_parse(json_data: dict) -> dict:
+    """The per-observation loop BLS.get_series used before parse_series
+    """
+    series_data = {k['seriesID']:'' for k in json_data['Results']['series']}
+    for series in json_data['Results']['series']:
+        data = list()
+        series_id = series['seriesID']
+        for item in series['data']:
+            year = item['year']
+            period = item['period']
+            value = item['value']
+            footnotes = ""
+            for footnote in item['footnotes']:
+                if footnote:
+                    footnotes = footnotes + footnote['text'] + ','
+            if 'M01' <= period <= 'M12':
+                data.append({'series_id' : series_id, 'year' : year, 'period' : period, 'value' : value, 'footnotes' : footnotes[0:-1]})
+        data = pd.DataFrame.from_dict(data)
+        series_data[series_id] = data
+    return(series_data)
+
+def legacy_transform(json_data: dict, msa: pd.DataFrame) -> pd.DataFrame:
+    """The steps extract_bls & transform_bls used before parse_series & BLS.normalize
+    """
+    api = pd.concat(legacy_parse(json_data)).reset_index(drop = True)
+    api['period'] = api['period'].str[1:]
+    api = api.rename(columns = {'period' : 'month'})
+    api = label_api(api)
+
+    msa = msa.copy()
+    api['value'] = api['value'].astype('str')
+    msa['value'] = msa['value'].astype('str')
+    api['value'] = api['value'].str.replace(r'\.0','',regex=True)
+    api['value'] = api['value'].astype('object')
+
+    df = pd.concat([api, msa], axis = 0, ignore_index = True, sort = True)
+    df = df.loc[df['year'] != 'n',:].copy()
+
+    df['date'] = df['month'].astype('str')
+    df.loc[df['date'].str.len() == 1, 'date'] = '0' + df['date']
+    df['date'] =  df['date'] + '-' + df['year'].astype('str')
+    df['date'] = pd.to_datetime(df['date'], format = '%m-%Y')
+    df['date'] = df['date'].dt.date
+
+    df['value'] = df['value'].str.replace('-','') # Remove "-" as value, comes from MSA file
+    df['value'] = df['value'].replace({'(n)' : ''})
+
+    df['fips_area'] = df['fips_area'].astype('float64')
+    df['fips_area'] = df['fips_area'].astype('Int64')
+    return(df)
+
+def vectorized_transform(bls: BLS, json_data: dict, msa: pd.DataFrame) -> pd.DataFrame:
+    """parse_series, then BLS.normalize on the aggregated frame
+    """
+    api = label_api(bls.parse_series(json_data))
+    return(bls.normalize(pd.concat([api, msa], axis = 0, ignore_index = True)))
+
+def timed(function, repeat: int, *args) -> tuple:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        times.append(time.perf_counter() - start)
+    return(min(times), result)
+
+# -- Main -----------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--start-year', type = int, default = 1990)
+    args = parser.parse_args()
+
+    json_data = laus_payload(start_year = args.start_year)
+    msa = msa_frame(start_year = args.start_year)
+    bls = BLS()
+
+    legacy_time, legacy = timed(legacy_transform, args.repeat, json_data, msa)
+    vectorized_time, vectorized = timed(vectorized_transform, args.repeat, bls, json_data, msa)
+
+    # Same dates, values & FIPS areas either way
+    assert (pd.to_datetime(legacy['date']).to_numpy() == vectorized['date'].to_numpy()).all()
+    assert np.allclose(pd.to_numeric(legacy['value']).to_numpy('float64'), vectorized['value'].to_numpy('float64'), equal_nan = True)
+    assert legacy['fips_area'].astype('Int32').reset_index(drop = True).equals(vectorized['fips_area'])
+
+    print(f"Rows                 | {len(vectorized):,}")
+    print(f"Legacy               | {legacy_time:.3f}s | {legacy.memory_usage(deep = True).sum() / 1e6:,.1f} MB")
+    print(f"Vectorized           | {vectorized_time:.3f}s | {vectorized.memory_usage(deep = True).sum() / 1e6:,.1f} MB")
+    print(f"Speed-up             | {legacy_time / vectorized_time:.1f}x")
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Benchmark for PostgreSQL.export (COPY ... TO STDOUT) against execute_fetchall for full-table reads.
+   Builds a multi-million-row table shaped like dems_bls_laus with generate_series, so it needs only
+   a database to connect to; the table & the Parquet output (written to a temporary directory) are removed afterwards.
+
+   Example:
+       $ python3 python/benchmarks/sql_export.py --host localhost --dbname dems --username postgres --rows 3000000
+"""
+
+# -- Imports --------------------------------------------------------------------------------
+import os, argparse, time, tempfile
+
+import pandas as pd
+
+from probitaspy.ppy_sql import PostgreSQL
+
+# -- Data -----------------------------------------------------------------------------------
+
+def create_table(db: PostgreSQL, table: str, rows: int) -> None:
+    """Synthetic LAUS-like table: scope & series labels, FIPS codes with NULLs, monthly dates, float values,
+       and load times with fractional seconds entered at a non-UTC offset
+    """
+    db.execute_commit(f"""
+        DROP TABLE IF EXISTS {table};
+        CREATE TABLE {table} AS
+        SELECT
+            (ARRAY['National','State','Metropolitan Area'])[1 + i % 3] AS geo_scope,
+            (i % 56)::smallint AS fips_state,
+            CASE WHEN i % 3 = 2 THEN 10000 + i % 400 END AS fips_area,
+            'Area ' || (i % 400) AS name_area,
+            (ARRAY['Labor Force','Employment','Unemployment','Unemployment Rate'])[1 + i % 4] AS laus_series_name,
+            DATE '1990-01-01' + ((i % 420) * INTERVAL '1 month') AS laus_date,
+            random() * 1000 AS laus_value,
+            TIMESTAMPTZ '2020-03-08 01:30:00.25-05' + (i % 100000) * INTERVAL '1.5 second' AS data_loaded_on
+        FROM generate_series(1, {int(rows)}) AS i;
+        ANALYZE {table};
+        """)
+
+# -- Implementations ------------------------------------------------------------------------
+
+def fetchall_frame(db: PostgreSQL, sql: str) -> pd.DataFrame:
+    """Row-by-row fetch into a DataFrame, as the flows read tables before export
+    """
+    rows = db.execute_fetchall(sql)
+    return(pd.DataFrame(rows, columns = [c.name for c in db.cursor.description]))
+
+def check_values(db: PostgreSQL, sql: str) -> None:
+    """export returns the values execute_fetchall does. COPY writes timestamptz in UTC with a '+00' offset,
+       which the CSV reader must parse to the same instants
+    """
+    fetched = fetchall_frame(db, sql)
+    exported = db.export(sql)
+    assert (pd.to_datetime(fetched['data_loaded_on'], utc = True) == exported['data_loaded_on']).all()
+    assert (pd.to_datetime(fetched['laus_date']) == exported['laus_date']).all()
+    assert fetched['fips_area'].astype('Int32').equals(exported['fips_area'])
+    assert (fetched['laus_value'] == exported['laus_value']).all()
+
+def timed(function, repeat: int) -> tuple:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return(min(times), result)
+
+# -- Main -----------------------------------------------------------------------------------
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = __doc__.splitlines()[0])
+    parser.add_argument('--host', default = 'localhost')
+    parser.add_argument('--port', default = '5432')
+    parser.add_argument('--dbname', default = 'postgres')
+    parser.add_argument('--username', default = 'postgres')
+    parser.add_argument('--password', default = '')
+    parser.add_argument('--rows', type = int, default = 3000000)
+    parser.add_argument('--repeat', type = int, default = 3)
+    parser.add_argument('--table', default = 'benchmark_export')
+    args = parser.parse_args()
+
+    db = PostgreSQL(username = args.username, password = args.password, host = args.host, port = args.port, dbname = args.dbname)
+    create_table(db, args.table, args.rows)
+    sql = f'SELECT * FROM {args.table}'
+    output = tempfile.TemporaryDirectory()
+
+    try:
+        check_values(db, f'{sql} ORDER BY laus_date, data_loaded_on, laus_value LIMIT 10000')
+
+        fetchall_time, fetched = timed(lambda: fetchall_frame(db, sql), args.repeat)
+        fetched_memory = fetched.memory_usage(deep = True).sum() / 1e6
+        fetched = None
+        export_time, exported = timed(lambda: db.export(sql), args.repeat)
+        parquet_time, _ = timed(lambda: db.export(sql, output = 'parquet', path = os.path.join(output.name, f'{args.table}.parquet')), args.repeat)
+
+        assert len(exported) == args.rows
+
+        print(f"Rows                 | {args.rows:,}")
+        print(f"execute_fetchall     | {fetchall_time:.3f}s | {fetched_memory:,.1f} MB")
+        print(f"export (DataFrame)   | {export_time:.3f}s | {exported.memory_usage(deep = True).sum() / 1e6:,.1f} MB")
+        print(f"export (Parquet)     | {parquet_time:.3f}s")
+        print(f"Speed-up             | {fetchall_time / export_time:.1f}x")
+    finally:
+        db.execute_commit(f'DROP TABLE IF EXISTS {args.table}')
+        db.disconnect()
+        output.cleanup()
@@ -6,6 +6,7 @@
 import prefect
 from prefect import task, Flow
 from prefect.engine import signals
+from prefect.triggers import always_run
 from prefect.schedules import IntervalSchedule
 from prefect import Parameter
 
@@ -13,10 +14,55 @@ from datetime import timedelta
 from prefect.schedules import Schedule
 from prefect.schedules.clocks import CronClock
 
+def process_msa(msa_employment):
+    """Shapes the parsed ssamatab1 sheet (see ppy_msa.MSAEmployment) into the long LAUS format,
+       adding a copy of each multi-state metro area for each of its additional states.
+    """
+    global pd, geo, laus_series_names, fips_state_names
+
+    # -- Prefect Setup -- #
+    logger = prefect.context.get("logger")
+    # -- Prefect Setup -- #
+
+    rename_cols = {'LAUS Code' : 'series_id', 'State FIPS Code' : 'fips_state', 'Area FIPS Code' : 'fips_area', 'Area' : 'name_area',
+                   'Year' : 'year', 'Month' : 'month', 'Civilian Labor Force' : 'Labor Force'}
+
+    msa_employment = msa_employment.rename(columns = rename_cols)
+
+    # FIPS codes, year & month arrive as integers from ppy_msa
+    msa_employment['series_id'] = 'LAS' + msa_employment['series_id']
+    msa_employment['fips_state'] = msa_employment['fips_state'].astype('str').str.zfill(2)
+    msa_employment['fips_area'] = msa_employment['fips_area'].astype('str')
+
+    msa_employment = pd.melt(
+        msa_employment,
+        id_vars = ['series_id', 'fips_state', 'fips_area', 'name_area', 'year', 'month'],
+        value_vars = ['Labor Force', 'Employment', 'Unemployment', 'Unemployment Rate']
+    )
+
+    msa_employment = msa_employment.rename(columns = {'variable' : 'laus_series_name'})
+
+    msa_employment['laus_series_id'] = msa_employment['laus_series_name'].map({v:k for (k,v) in laus_series_names.items()})
+    msa_employment['series_id'] = msa_employment['series_id'] + '0' + msa_employment['laus_series_id'].astype('str')
+    msa_employment['name_state'] = msa_employment['fips_state'].map(fips_state_names)
+    msa_employment['type_area'] = msa_employment['name_area'].str.rsplit(' ',1,expand = True)[1]
+    msa_employment['type_area'] = msa_employment['type_area'].str.replace('NECTA', 'Met NECTA')
+    msa_employment['name_area'] = msa_employment['name_area'].str.replace(' MSA','')
+    msa_employment['name_area'] = msa_employment['name_area'].str.replace(' Met NECTA','')
+    msa_employment['geo_scope'] = 'Metropolitan Area'
+    msa_employment['flags'] = ''
+
+    msa_employment = msa_employment.loc[:,['series_id', 'laus_series_id', 'fips_state', 'fips_area', 'name_state', 'name_area', 'type_area', 'laus_series_name', 'year', 'month', 'value', 'geo_scope', 'flags']]
+
+    msa_rows = len(msa_employment)
+    msa_employment = geo.split_multi_state_areas(msa_employment, name_col = 'name_area', fips_col = 'fips_state', state_name_col = 'name_state')
+    logger.info(f"MSA Multi-State Data - {len(msa_employment) - msa_rows} rows added")
+    return(msa_employment)
+
 @task(name="Create Static Variables")
 def create_static_variables(run_style, bls_key):
     
-    global sys, json, np, pd, datetime, ppy, ppy_auth, ppy_api, ppy_sql, ppy_geo, ppy_box, ppy_web
+    global sys, json, np, pd, datetime, ppy, ppy_auth, ppy_api, ppy_sql, ppy_geo, ppy_box, ppy_web, ppy_watermarks, ppy_msa, ppy_schema
 
     import sys, os, ntpath
     
@@ -34,23 +80,34 @@ def create_static_variables(run_style, bls_key):
     import ppy_geography as ppy_geo
     import ppy_box
     import ppy_web
+    import ppy_watermarks
+    import ppy_msa
+    import ppy_schema
     
     # -- Prefect Setup -- #
     logger = prefect.context.get("logger")
     # -- Prefect Setup -- #
     
-    global auth, box, geo, testing, bls, fips, us_series, laus_series_names, fips_state_names, year_breakpoints
+    global auth, box, geo, testing, bls, fips, us_series, laus_series_names, fips_state_names, year_range, watermarks, revision_months, msa_source, artifact_folder
     
     if 'c' in run_style:
         auth = ppy_auth.Auth()
         box = ppy_box.ProbitasBox()
         geo = ppy_geo.Geographies()
+        watermarks = ppy_watermarks.Watermarks('bls')
+        msa_source = ppy_msa.MSAEmployment()
+        # Parquet files handed between stages are kept alongside the CSV export
+        artifact_folder = box.get_parent_id('643017915800')
 
         testing = False
 
         try:
-            bls = ppy_api.BLS(api_key = auth.get_secret('dev/api/bls').get(bls_key))
-            logger.info(str(bls_key))
+            # Responses are cached for 12 hours, so re-running a failed flow does not repeat its requests
+            cache = ppy_web.ResponseCache(default_ttl = 12 * 60 * 60, logger = logger)
+            # bls_key names the key(s) of the secret to use, comma separated, or 'all' for the whole pool
+            key_names = None if bls_key == 'all' else bls_key.split(',')
+            bls = ppy_api.BLS(api_key = auth.get_keys('dev/api/bls', names = key_names), cache = cache)
+            logger.info(f"{bls_key} | {len(bls.keys.keys)} key(s)")
 
             fips = ppy_geo.Geographies().states
             if testing:
@@ -71,10 +128,11 @@ def create_static_variables(run_style, bls_key):
                 4 : 'Unemployment',
                 3 : 'Unemployment Rate'}
 
-            year_breakpoints = [
-                {'start' : '1990', 'stop' : '2000'},
-                {'start' : '2001', 'stop' : '2010'},
-                {'start' : '2011', 'stop' : '2020'}]
+            # Backfill range, through the current year. Split into the fewest valid requests by bls.plan_requests
+            year_range = {'start' : '1990', 'stop' : str(datetime.now().year)}
+
+            # Incremental runs re-pull this many months before each series' watermark, to capture revisions
+            revision_months = 12
 
             fips_state_names = dict(zip(ppy.findkeys(fips, 'fips_state'), ppy.findkeys(fips, 'name_state')))
 
@@ -87,7 +145,7 @@ def create_static_variables(run_style, bls_key):
         logger.info("C - Skipped")
 
 @task(name="Extract BLS Data")
-def extract_bls(run_style):
+def extract_bls(run_style, incremental):
     # -- Prefect Setup -- #
     logger = prefect.context.get("logger")
     # -- Prefect Setup -- #
@@ -95,156 +153,75 @@ def extract_bls(run_style):
     if 'e' in run_style:
         logger.info("Retrieving U.S. Data")
 
-        global pd, np, json, sys, auth, box, geo, ppy, ppy_web, ppy_geo, testing, bls, fips, us_series, laus_series_names, fips_state_names, year_breakpoints, us_employment, state_employment, msa_employment
+        global pd, np, json, sys, auth, box, geo, ppy, ppy_web, ppy_geo, testing, bls, fips, us_series, laus_series_names, fips_state_names, year_range, watermarks, revision_months, msa_source, artifact_folder, us_employment, state_employment, msa_employment
 
         try:  
+            # -- US & State -----------------------------------------------
+            # All series are fetched together, packed into as few requests as the API allows
+            for i in range(0,len(fips)):
+                fips[i]['codes'] = bls.generate_laus(fips[i]['fips_state'])
+            if testing:
+                print("In Testing Mode.")
+                print(fips)
+
+            state_series = [l for i in range(0,len(fips)) for l in fips[i]['codes']['laus']]
+            all_series = list(us_series.keys()) + state_series
+            # Requests an earlier run deferred past its daily quota are resumed first, then this run's plan is made.
+            # Requests this run's plan shares with the queue are only made once
+            resumed = bls.run_deferred('default')
+            logger.info(f"Deferred requests resumed - {resumed['series_id'].nunique()} series, {len(resumed)} rows")
+            if incremental:
+                employment = bls.get_series_incremental(all_series, watermarks, lookback_months = revision_months, backfill_start = year_range['start'])
+            else:
+                logger.info(f"Requests planned - {len(bls.plan_requests(all_series, year_range['start'], year_range['stop']))}")
+                employment = bls.get_series_batch(all_series, start_year = year_range['start'], end_year = year_range['stop'])
+            # Where a resumed request & this run's plan overlap, this run's values are kept
+            employment = bls.concat_series([resumed, employment]).drop_duplicates(['series_id', 'year', 'month'], keep = 'last').reset_index(drop = True)
+            logger.info(f"Requests made - {bls.requests_made} | Remaining today - {bls.keys.remaining()}")
+            # Requests over the daily quota stay queued for the next run; full loads refuse to swap in a partial master
+            deferred = bls.queue.pending('default')
+            if deferred:
+                logger.warning(f"Requests deferred to the next quota window - {len(deferred)}")
+
             # -- US -----------------------------------------------
-            us_employment = []
-            try:
-                for year_range in year_breakpoints:
-                    data_partial = bls.get_series(list(us_series.keys()), start_year = year_range['start'], end_year = year_range['stop'])
-                    data_partial = pd.concat(data_partial).reset_index(drop = True)
-                    us_employment.append(data_partial)
-                us_employment = pd.concat(us_employment).reset_index(drop = True)
-            except:
-                logger.info(str(bls.get_series(list(us_series.keys()), start_year = year_range['start'], end_year = year_range['stop'])))
+            us_employment = employment.loc[employment['series_id'].isin(list(us_series.keys()))].reset_index(drop = True)
 
             us_employment['geo_scope'] = 'National'
             us_employment['fips_state'] = '99'
             us_employment['name_state'] = 'United States'
 
-            us_employment['period'] = us_employment['period'].str[1:]
-            us_employment = us_employment.rename(columns = {'period' : 'month'})
-
             us_employment['laus_series_name'] = us_employment['series_id'].map(us_series)
 
             us_employment = us_employment.loc[:,['series_id', 'fips_state', 'name_state', 'laus_series_name', 'year', 'month', 'value', 'footnotes', 'geo_scope']]
             logger.info(f"U.S. Data - {us_employment.shape}")
 
             # -- State -----------------------------------------------        
-            for i in range(0,len(fips)):
-                fips[i]['codes'] = bls.generate_laus(fips[i]['fips_state'])
-            if testing:
-                print("In Testing Mode.")
-                print(fips)
-            else:
-                next(iter(fips))
-
-            for i in range(0,len(fips)):
-                for k,v in fips[i]['codes'].items():
-                    try:
-                        data_key = str(k) + '_data'
-                        data = []
-                        for year_range in year_breakpoints:
-                            data_partial = bls.get_series(v, start_year = year_range['start'], end_year = year_range['stop'])
-                            data_partial = pd.concat(data_partial, ignore_index = True).reset_index(drop = True)
-                            data.append(data_partial)
-                        data = pd.concat(data, ignore_index = True).reset_index(drop = True)
-                        fips[i][data_key] = data
-                    except:
-                        logger.info(f"{str(fips[i])} - {v} | {year_range['start']} | {year_range['stop']}")
-
-            state_employment = list(ppy.findkeys(fips, 'laus_data'))
-            state_employment = pd.concat(state_employment, ignore_index = True)
+            state_employment = employment.loc[employment['series_id'].isin(state_series)].reset_index(drop = True)
             state_employment['fips_state'] = state_employment['series_id'].str[5:7]
             state_employment['laus_series_id'] = state_employment['series_id'].str[-1:].astype('int64')
 
             data_year_range = [int(x) for x in state_employment['year'].unique()]
 
-            logger.info("Start Year of State Data |", min(data_year_range))
-            logger.info("End Year of State Data   |", max(data_year_range))
+            if data_year_range:
+                logger.info(f"Start Year of State Data | {min(data_year_range)}")
+                logger.info(f"End Year of State Data   | {max(data_year_range)}")
 
             state_employment['laus_series_name'] = state_employment['laus_series_id'].map(laus_series_names)
             state_employment['name_state'] = state_employment['fips_state'].map(fips_state_names)
             state_employment['geo_scope'] = 'State'
 
-            state_employment['period'] = state_employment['period'].str[1:]
-            state_employment = state_employment.rename(columns = {'period' : 'month'})
             state_employment = state_employment.loc[:,['series_id', 'laus_series_id', 'fips_state', 'name_state', 'laus_series_name', 'year', 'month', 'value', 'footnotes', 'geo_scope']]
 
             logger.info(f"State Data - {state_employment.shape}")
 
-            msa_employment_url = 'https://www.bls.gov/web/metro/ssamatab1.zip'
-            msa_employment_file_name = 'ssamatab1.xlsx'
-
-            import zipfile, io
-            r = ppy_web.create_session()
-            response = r.get(msa_employment_url, stream = True)
-            z = zipfile.ZipFile(io.BytesIO(response.content))
-
-            with z as msazip:
-                msa_employment = pd.read_excel(io.BytesIO(z.read(msa_employment_file_name)),
-                skiprows = 2)
-
-            # Skip blank row between header & data
-            msa_employment = msa_employment.iloc[1:,]
-            # Remove empty rows & descriptive text at the end of the file
-            msa_employment = msa_employment.loc[~((pd.isnull(msa_employment['LAUS Code'])) | (pd.isnull(msa_employment['Area'])))]
-
-            rename_cols = {'LAUS Code' : 'series_id', 'State FIPS Code' : 'fips_state', 'Area FIPS Code' : 'fips_area', 'Area' : 'name_area',
-                           'Year' : 'year', 'Month' : 'month', 'Civilian Labor Force' : 'Labor Force'}
-
-            msa_employment = msa_employment.rename(columns = rename_cols)
-
-            msa_employment['series_id'] = 'LAS' + msa_employment['series_id'].astype('str')
-            msa_employment['fips_state'] = msa_employment['fips_state'].astype('str').str[:-2]
-            msa_employment.loc[msa_employment['fips_state'].str.len() == 1,'fips_state'] = '0' + msa_employment.loc[msa_employment['fips_state'].str.len() == 1,'fips_state']
-            msa_employment['fips_area'] = msa_employment['fips_area'].astype('str').str[:-2]
-            msa_employment['year'] = msa_employment['year'].astype('str').str[:-2]
-            msa_employment['month'] = msa_employment['month'].astype('str').str[:-2]
-
-            msa_employment = pd.melt(
-                msa_employment,
-                id_vars = ['series_id', 'fips_state', 'fips_area', 'name_area', 'year', 'month'],
-                value_vars = ['Labor Force', 'Employment', 'Unemployment', 'Unemployment Rate']
-            )
-
-            msa_employment = msa_employment.rename(columns = {'variable' : 'laus_series_name'})
-
-            msa_employment['laus_series_id'] = msa_employment['laus_series_name'].map({v:k for (k,v) in laus_series_names.items()})
-            msa_employment['series_id'] = msa_employment['series_id'] + '0' + msa_employment['laus_series_id'].astype('str')
-            msa_employment['name_state'] = msa_employment['fips_state'].map(fips_state_names)
-            msa_employment['type_area'] = msa_employment['name_area'].str.rsplit(' ',1,expand = True)[1]
-            msa_employment['type_area'] = msa_employment['type_area'].str.replace('NECTA', 'Met NECTA')
-            msa_employment['name_area'] = msa_employment['name_area'].str.replace(' MSA','')
-            msa_employment['name_area'] = msa_employment['name_area'].str.replace(' Met NECTA','')
-            msa_employment['geo_scope'] = 'Metropolitan Area'
-            msa_employment['flags'] = ''
-
-            msa_employment = msa_employment.loc[:,['series_id', 'laus_series_id', 'fips_state', 'fips_area', 'name_state', 'name_area', 'type_area', 'laus_series_name', 'year', 'month', 'value', 'geo_scope']]
-
-            msa_names = msa_employment['name_area']
-            msa_states = msa_names.str.split(',',1,expand=True)[1]
-            msa_states_multiple = msa_states[msa_states.str.match('(.*?)\-(.*?)')].index
-            msa_names_multiple = msa_employment.iloc[msa_states_multiple,:]['name_area'].drop_duplicates().sort_values()
-
-            state_fips_mapping = geo.states.set_index('abbreviation_state').to_dict(orient = 'index')
-            msa_multi_state = []
-            for msa in msa_names_multiple:
-                msa_employment.loc[msa_employment['name_area'] == msa,'flags'] = 'Multi-State Metro Area'
-                copy = msa_employment.loc[msa_employment['name_area'] == msa,:].copy()
-
-                states = msa.split(',',1)[1].strip()
-                states = states.split('-')    
-                for state in states[1:]:
-                    state_fips = state_fips_mapping.get(state).get('fips_state')
-                    state_name = state_fips_mapping.get(state).get('name_state')
-
-                    copy_state = copy.copy()
-
-                    copy_state['fips_state'] = state_fips
-                    copy_state['name_state'] = state_name
-                    msa_multi_state.append(copy_state)
-
-            msa_multi_state = pd.concat(msa_multi_state)
-            logger.info(f"MSA Multi-State Data - {msa_multi_state.shape}")
-
-            msa_employment = pd.concat([msa_employment, msa_multi_state], ignore_index = True, sort = True)
+            # Downloaded only when BLS has published a new file, parsed from a memory-mapped cache
+            msa_employment = process_msa(msa_source.read())
             logger.info(f"MSA Data - {msa_employment.shape}")
 
-            box.update_file('674554972731', us_employment)
-            box.update_file('642944900692', state_employment)
-            box.update_file('642940368966', msa_employment)
+            # Typed hand-off to the transform stage
+            box.put_parquet(artifact_folder, us_employment, 'bls_us_employment.parquet')
+            box.put_parquet(artifact_folder, state_employment, 'bls_state_employment.parquet')
+            box.put_parquet(artifact_folder, msa_employment, 'bls_msa_employment.parquet')
 
             logger.info(f"Data uploaded to Box")
         except:
@@ -263,21 +240,17 @@ def transform_bls(run_style):
     if 't' in run_style:
         logger.info("Transforming Data")
 
-        global sys, json, pd, datetime, box, geo, us_employment, state_employment, msa_employment
+        global sys, json, pd, datetime, box, geo, bls, artifact_folder, us_employment, state_employment, msa_employment, master
         
         if 'e' not in run_style:
-            us_employment = pd.read_csv(box.get_file('674554972731'))
-            state_employment = pd.read_csv(box.get_file('642944900692'))
-            msa_employment = pd.read_csv(box.get_file('642940368966'))
+            # Typed Parquet from the last extract, reading only the columns the transform uses
+            columns = ['fips_state', 'name_state', 'laus_series_name', 'year', 'month', 'value', 'geo_scope']
+            us_employment = box.get_artifact(artifact_folder, 'bls_us_employment.parquet', columns = columns)
+            state_employment = box.get_artifact(artifact_folder, 'bls_state_employment.parquet', columns = columns)
+            # Metro rows as the last extract shaped them, multi-state areas already split
+            msa_employment = box.get_artifact(artifact_folder, 'bls_msa_employment.parquet')
 
         try:
-            us_employment['value'] = us_employment['value'].astype('str')
-            state_employment['value'] = state_employment['value'].astype('str')
-            msa_employment['value'] = msa_employment['value'].astype('str')
-            
-            us_employment['value'] = us_employment['value'].str.replace('\.0','',regex=True)
-            us_employment['value'] = us_employment['value'].astype('object')
-
             # Removed footnotes, laus_series_id, series_id column
             column_order = ['fips_state', 'fips_area', 'name_state', 'name_area', 'type_area', 'geo_scope', 'laus_series_name', 'year', 'month', 'date', 'value', 'flags']
 
@@ -289,20 +262,8 @@ def transform_bls(run_style):
 
             aggregated_employment = pd.concat([us_employment, state_employment, msa_employment], axis = 0, ignore_index = True, sort = True)
 
-            aggregated_employment = aggregated_employment.loc[aggregated_employment['year'] != 'n',:]
-
-            aggregated_employment['date'] = aggregated_employment['month'].astype('str')
-            aggregated_employment.loc[aggregated_employment['date'].str.len() == 1, 'date'] = '0' + aggregated_employment['date']
-            aggregated_employment['date'] =  aggregated_employment['date'] + '-' + aggregated_employment['year'].astype('str')
-            aggregated_employment['date'] = pd.to_datetime(aggregated_employment['date'], format = '%m-%Y')
-            aggregated_employment['date'] = aggregated_employment['date'].dt.date
-
-            aggregated_employment['value'] = aggregated_employment['value'].str.replace('-','') # Remove "-" as value, comes from MSA file
-            aggregated_employment['value'].replace({'(n)' : ''}, inplace = True)
-            
-            aggregated_employment['fips_area'] = aggregated_employment['fips_area'].astype('float64')
-            # aggregated_employment['fips_area'] = aggregated_employment['fips_area'].str.replace('\.0','',regex=True)
-            aggregated_employment['fips_area'] = aggregated_employment['fips_area'].astype('Int64')
+            # Integer year/month -> date, numeric values & compact FIPS dtypes, in vectorized steps
+            aggregated_employment = bls.normalize(aggregated_employment)
 
             aggregated_employment = aggregated_employment[column_order]
             master = aggregated_employment
@@ -311,10 +272,6 @@ def transform_bls(run_style):
             master['data_loaded_on'] = datetime.now()
             master['data_loaded_by'] = getpass.getuser()
             logger.info(f"Combined Data Shape - {master.shape}")
-
-            box.update_file('643017915800', master)
-            box.update_file('657669300653', master, sep='\t', index = False, header = False)
-            logger.info(f"Transformed Data uploaded to Box")     
         except:
             logger.error("Failed to tranform Data")
             logger.error(json.dumps(sys.exc_info()[0]))
@@ -323,44 +280,54 @@ def transform_bls(run_style):
         logger.info("T - Skipped")
         
 @task(name="Load BLS Data")        
-def load_bls(run_style):
-    global sys, json, ppy_sql, auth, box
+def load_bls(run_style, incremental):
+    global sys, json, pd, ppy_sql, ppy_schema, auth, box, bls, artifact_folder, master, watermarks, us_employment, state_employment
     
     if 'l' in run_style:
 
         db = ppy_sql.PostgreSQL(**auth.get_secret("dev/rds/postgresql"))
-        # Drop existing table
-        db.drop_table('dems_bls_laus')
         # -- Prefect Setup -- #
         logger = prefect.context.get("logger")
         # -- Prefect Setup -- #
         logger.info(f"Uploading data to {db.dbname}")
 
-        # SQL command to create LAUS table
-        create_table_dems_bls_laus = """
-            CREATE TABLE IF NOT EXISTS dems_bls_laus(
-                fips_state INT,
-                fips_area INT,
-                name_state TEXT,
-                name_area TEXT,
-                type_area TEXT,
-                geo_scope TEXT,
-                laus_series_name TEXT,
-                laus_year INT,
-                laus_month INT,
-                laus_date DATE,
-                laus_value NUMERIC,
-                flags TEXT,
-                data_loaded_on TIMESTAMP,
-                data_loaded_by TEXT
-            )
-            """
-
-        # Execute SQL Command and commit to DB
-        db.execute_commit(create_table_dems_bls_laus)
-
-        f = box.get_file('657669300653')
-        db.copy_from(f, 'dems_bls_laus', sep='\t', null = '')
+        # LAUS table, partitioned by date & indexed on its natural key (see ppy_schema)
+        schema = ppy_schema.dems_bls_laus
+        schema.create(db)
+
+        # A full load replaces the whole table, so it waits until no extract requests are left deferred
+        deferred = bls.queue.pending('default')
+        if not incremental and deferred:
+            logger.error(f"Full load skipped - {len(deferred)} requests deferred to the next quota window, so the data is incomplete")
+            db.disconnect()
+            raise signals.FAIL()
+
+        # Load-only runs read the typed Parquet handed off by the last transform (see archive_bls)
+        if 't' not in run_style:
+            master = box.get_artifact(artifact_folder, 'bls_master.parquet')
+
+        # dems_bls_laus stays readable throughout: incremental runs merge the re-pulled rows on the natural key
+        # (metro rows are re-read in full from ssamatab1, so metro areas no longer published are removed),
+        # full runs build a new copy of the table, with its indexes built after the copy, and swap it in
+        if incremental:
+            metro = (master['geo_scope'] == 'Metropolitan Area').any()
+            db.upsert_dataframe(master, 'dems_bls_laus',
+                                keys = schema.natural_key,
+                                ignore = ['data_loaded_on', 'data_loaded_by'],
+                                prune = "geo_scope = 'Metropolitan Area'" if metro else '')
+        else:
+            db.swap_dataframe(master, 'dems_bls_laus', schema = schema)
+
+        # Watermarks only move forward once the data has been loaded
+        if incremental and not db.last_error:
+            # Keyed by the series IDs the API returned, from this run's extract or the artifacts of the last one
+            if 'e' in run_style:
+                extracted = [us_employment, state_employment]
+            else:
+                extracted = [box.get_artifact(artifact_folder, f, columns = ['series_id', 'year', 'month']) for f in ['bls_us_employment.parquet', 'bls_state_employment.parquet']]
+            extracted = pd.concat([f[['series_id', 'year', 'month']] for f in extracted], ignore_index = True)
+            extracted_dates = pd.to_datetime(extracted[['year', 'month']].assign(day = 1))
+            watermarks.update({k : v.strftime('%Y-%m-%d') for k,v in extracted_dates.groupby(extracted['series_id'].astype('str')).max().items()})
 
         # Disconnect from DB
         db.disconnect()
@@ -369,17 +336,43 @@ def load_bls(run_style):
     else:
         logger.info("L - Skipped")
 
+@task(name="Archive BLS Data", trigger = always_run)
+def archive_bls(run_style, archive):
+    """Copies the transformed data to Box, as Parquet for load-only runs and, with archive, as CSV & TSV exports.
+       Runs after the load, even if it failed, so the load does not wait on Box uploads.
+    """
+    # -- Prefect Setup -- #
+    logger = prefect.context.get("logger")
+    # -- Prefect Setup -- #
+
+    global box, artifact_folder, master
+
+    if 't' not in run_style or 'master' not in globals():
+        logger.info("Archive - Skipped")
+        return
+
+    box.put_parquet(artifact_folder, master, 'bls_master.parquet')
+
+    if archive:
+        box.update_file('643017915800', master, streaming = True)
+        box.update_file('657669300653', master, sep='\t', index = False, header = False, streaming = True)
+    logger.info(f"Transformed Data uploaded to Box")
+
 cron = '0 0 1 * *'
 schedule = Schedule(clocks=[CronClock(cron)])
 with Flow("bls", schedule) as flow:
-    bls_key = Parameter("bls_key", default="key")
+    bls_key = Parameter("bls_key", default="all")
     run_style = Parameter("run_style", default="cetl")
+    incremental = Parameter("incremental", default=True)
+    archive = Parameter("archive", default=True)
     
-    a, b, c, d = create_static_variables(run_style, bls_key), extract_bls(run_style), transform_bls(run_style), load_bls(run_style)
+    a, b, c, d = create_static_variables(run_style, bls_key), extract_bls(run_style, incremental), transform_bls(run_style), load_bls(run_style, incremental)
+    e = archive_bls(run_style, archive)
 
     flow.add_edge(a, b)
     flow.add_edge(b, c)
     flow.add_edge(c, d)
+    flow.add_edge(d, e)
 
 flow.register(project_name = "probitas-production")
 flow.run_agent()
\ No newline at end of file
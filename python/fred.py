@@ -1,8 +1,11 @@
 import prefect
 from prefect import task, Flow
 from prefect.engine import signals
+from prefect.triggers import always_run
 from prefect.schedules import IntervalSchedule
+from prefect import Parameter
 
+import io
 from datetime import timedelta
 from prefect.schedules import Schedule
 from prefect.schedules.clocks import CronClock
@@ -10,7 +13,7 @@ from prefect.schedules.clocks import CronClock
 @task
 def create_static_variables():
     
-    global np, pd, datetime, os, sys, time, json, ppy, ppy_auth, ppy_api, ppy_sql, ppy_geo, ppy_box
+    global np, pd, datetime, os, sys, time, json, ppy, ppy_auth, ppy_api, ppy_sql, ppy_geo, ppy_box, ppy_watermarks, ppy_web, ppy_schema
     
     import numpy as np
     import pandas as pd
@@ -26,21 +29,33 @@ def create_static_variables():
     import ppy_sql
     import ppy_geography as ppy_geo
     import ppy_box
+    import ppy_watermarks
+    import ppy_web
+    import ppy_schema
     
     # -- Prefect Setup -- #
     logger = prefect.context.get("logger")
     # -- Prefect Setup -- #
     
-    global auth, box, geo, testing, fred, fred_codes_us, fips, name_mapping, adjustment_mapping
+    global auth, box, geo, testing, fred, fred_codes_us, fips, registry, state_aliases, watermarks, revision_days, artifact_folder
     
     auth = ppy_auth.Auth()
     box = ppy_box.ProbitasBox()
+    # Parquet files handed between stages are kept alongside the CSV export
+    artifact_folder = box.get_parent_id('666718358067')
     geo = ppy_geo.Geographies()
+    watermarks = ppy_watermarks.Watermarks('fred')
     
     testing = False
+
+    # Incremental runs re-pull this many days before each series' watermark, to capture revisions
+    revision_days = 90
     
     try:
-        fred = ppy_api.FRED(api_key = auth.get_secret('dev/api/fred').get('key'), debug = testing)
+        # Responses are cached for 12 hours, so re-running a failed flow does not repeat its requests
+        cache = ppy_web.ResponseCache(default_ttl = 12 * 60 * 60, logger = logger)
+        # Requests are spread over every key in the secret, each with its own rate limit
+        fred = ppy_api.FRED(api_key = auth.get_keys('dev/api/fred'), debug = testing, cache = cache)
         
         fred_codes_us = [
             'ICSA', # Initial Claims, Seasonally Adjusted
@@ -71,55 +86,11 @@ def create_static_variables():
         for i in range(0,len(fips)):
             fips[i]['codes'] = fred.generate_fred_codes(fips[i]['abbreviation_state'])
             
-        name_mapping = {
-            'ICSA' : 'Initial Claims',
-            'IC4WSA' : '4-Week Moving Average of Initial Claims',
-            'CCSA' : 'Continued Claims',
-            'IURSA' : 'Insured Unemployment Rate',
-            'ICNSA' : 'Initial Claims',
-            'CCNSA' :  'Continued Claims',
-            'IURNSA' :  'Insured Unemployment Rate',
-            'COVEMP' : 'Covered Employment',
-            'ICLAIMS' : 'Initial Claims',
-            'CCLAIMS' : 'Continued Claims',
-            'CEMPLOY' : 'Covered Employment',
-            'INSUREDUR' : 'Insured Unemployment Rate',
-            'GDP' : 'Gross Domestic Product',
-            'CPIAUCSL' : 'Consumer Price Index',
-            'INDPRO' : 'Industrial Production Index',
-            'UMCSENT' : 'University of Michigan: Consumer Sentiment',
-            'M1' : 'M1 Money Stock',
-            'M1V' : 'Velocity of M1 Money Stock',
-            'M2' : 'M2 Money Stock',
-            'M2V' : 'Velocity of M2 Money Stock',
-            'WALCL' : 'Total Assets (Less Eliminations from Consolidation): Wednesday Level',
-            'FEDFUNDS' : 'Effective Federal Funds Rate'
-        }
-
-        adjustment_mapping = {
-            'ICSA' : 'Seasonally Adjusted',
-            'IC4WSA' : 'Seasonally Adjusted',
-            'CCSA' : 'Seasonally Adjusted',
-            'IURSA' : 'Seasonally Adjusted',
-            'ICNSA' : 'Not Seasonally Adjusted',
-            'CCNSA' :  'Not Seasonally Adjusted',
-            'IURNSA' :  'Not Seasonally Adjusted',
-            'COVEMP' : 'Not Seasonally Adjusted',
-            'ICLAIMS' : 'Not Seasonally Adjusted',
-            'CCLAIMS' : 'Not Seasonally Adjusted',
-            'CEMPLOY' : 'Not Seasonally Adjusted',
-            'INSUREDUR' : 'Not Seasonally Adjusted',
-            'GDP' : 'Seasonally Adjusted',
-            'CPIAUCSL' : 'Seasonally Adjusted',
-            'INDPRO' : 'Seasonally Adjusted',
-            'UMCSENT' : 'Not Seasonally Adjusted',
-            'M1' : 'Seasonally Adjusted',
-            'M1V' : 'Seasonally Adjusted',
-            'M2' : 'Seasonally Adjusted',
-            'M2V' : 'Seasonally Adjusted',
-            'WALCL' : 'Not Seasonally Adjusted',
-            'FEDFUNDS' : 'Not Seasonally Adjusted'
-        } 
+        # Metadata (title, seasonal adjustment, ...) is fetched from FRED and cached locally, refreshed monthly
+        registry = ppy_api.SeriesRegistry(fred, max_age_days = 30)
+
+        # State series share a label per indicator, e.g. ICLAIMS is labelled using ALICLAIMS' metadata
+        state_aliases = {l[2:] : l for v in fips[0]['codes'].values() for l in v}
         
         logger.info("Static variables configured.")
     except:
@@ -128,128 +99,222 @@ def create_static_variables():
         raise signals.FAIL()
 
 @task
-def extract_fred():
+def extract_fred(run_style, incremental):
     # -- Prefect Setup -- #
     logger = prefect.context.get("logger")
     # -- Prefect Setup -- #
-    logger.info("Retrieving U.S. Data")
+    if 'e' in run_style:
+        logger.info("Retrieving U.S. Data")
     
-    global box, fred, fred_codes_us, fips, name_mapping, adjustment_mapping, us, state
+        global box, fred, fred_codes_us, fips, state_aliases, us, state, watermarks, revision_days, datetime
     
-    try:
-        # -- US Data
-        for code in fred_codes_us:
-            globals()[code] = fred.series_observations(code)
-
-        us = [eval(l) for l in fred_codes_us]
-        us = pd.concat(us)
-        us_cols = ['date', 'geo_scope', 'geo_abbreviation', 'variable', 'value']
-        us = us[us_cols]
-        logger.info(f"U.S. Data Retrieved - {us.shape}")
+        try:
+            state_codes = [l for i in range(0,len(fips)) for v in fips[i]['codes'].values() for l in v]
+
+            # Series without a watermark return None, and are pulled in full
+            if incremental:
+                observation_start = watermarks.start_dates(fred_codes_us + state_codes, lookback_days = revision_days)
+                logger.info(f"Incremental pull - {sum(v is not None for v in observation_start.values())} series with watermarks")
+            else:
+                observation_start = None
+
+            # -- US Data
+            # Fetched with ALFRED real-time periods, so dems_fred_vintages records when each value was published.
+            # Full runs pull every vintage, incremental runs the periods since the revision window. Responses are
+            # paged, so long vintage histories are not cut off at FRED's 100,000 observations per response
+            if incremental:
+                realtime_start = (datetime.now() - pd.Timedelta(days = revision_days)).strftime('%Y-%m-%d')
+            else:
+                realtime_start = '1776-07-04'
+            us = fred.series_observations_batch(fred_codes_us, observation_start = observation_start, realtime_start = realtime_start, realtime_end = '9999-12-31')
+            us_cols = ['date', 'geo_scope', 'geo_abbreviation', 'variable', 'value', 'realtime_start', 'realtime_end']
+            us = us[us_cols]
+            logger.info(f"U.S. Data Retrieved - {us.shape}")
         
-        # -- State Data
-        for i in range(0,len(fips)):
-            for k,v in fips[i]['codes'].items():
-                time.sleep(1)
-                for l in v:
-                    data_key = str(l)[2:].lower() + '_data'
-                    data = fred.series_observations(l, scope = 'state')
-                    fips[i][data_key] = data
-                    
-        data = ['iclaims_data', 'cclaims_data', 'cemploy_data', 'insuredur_data']
-
-        for d in data:
-            globals()[d] = list(ppy.findkeys(fips, d))
-            globals()[d] = pd.concat(globals()[d])
-            globals()[d]['variable'] = d.replace('_data','').upper()
-            data_year_range = [datetime.strptime(x, '%Y-%m-%d') for x in globals()[d]['date'].unique()]
-            logger.info(f"Dataset: {d} | Start: {min(data_year_range)} | End: {max(data_year_range)} | Shape: {globals()[d].shape}")
+            # -- State Data
+            # One GeoFRED regional request per indicator covers every state
+            state_abbreviations = {f['fips_state'] : f['abbreviation_state'] for f in fips}
+            state = []
+            for variable, series_id in state_aliases.items():
+                codes = [f['abbreviation_state'] + variable for f in fips]
+                if observation_start is None or any(observation_start.get(c) is None for c in codes):
+                    start_date = None
+                else:
+                    start_date = min(observation_start.get(c) for c in codes)
+
+                data = fred.regional_data(series_id, variable = variable, region_type = 'state', start_date = start_date, geo_mapping = state_abbreviations)
+                if data is None or data.empty:
+                    # Fall back to per-state series, fetched concurrently & throttled to FRED's rate limit
+                    logger.info(f"Regional data unavailable for {variable}, fetching {len(codes)} series")
+                    data = fred.series_observations_batch(codes, scope = 'state', observation_start = observation_start)
+                state.append(data)
+            state = pd.concat(state, ignore_index = True)
+
+            for d, data in state.groupby('variable', observed = True):
+                logger.info(f"Dataset: {d} | Start: {data['date'].min()} | End: {data['date'].max()} | Shape: {data.shape}")
             
-        state = pd.concat([iclaims_data, cclaims_data, cemploy_data, insuredur_data])
-        state_cols = ['date', 'geo_scope', 'geo_abbreviation', 'variable', 'value']
-        state = state[state_cols]
-        logger.info(f"State Data Retrieved - {state.shape}")
+            state_cols = ['date', 'geo_scope', 'geo_abbreviation', 'variable', 'value']
+            state = state[state_cols]
+            logger.info(f"State Data Retrieved - {state.shape}")
         
-        box.update_file('666716428023', us)
-        box.update_file('666717301983', state)
-        logger.info(f"Data uploaded to Box")
+            # Typed hand-off to the transform stage
+            box.put_parquet(artifact_folder, us, 'fred_us.parquet')
+            box.put_parquet(artifact_folder, state, 'fred_state.parquet')
+            logger.info(f"Data uploaded to Box")
         
-    except:
-        logger.error("Failed to extract Data")
-        logger.error(json.dumps(sys.exc_info()[0]))
-        raise signals.FAIL() 
+        except:
+            logger.error("Failed to extract Data")
+            logger.error(json.dumps(sys.exc_info()[0]))
+            raise signals.FAIL() 
+    else:
+        logger.info("E - Skipped")
         
 @task
-def transform_fred():
+def transform_fred(run_style):
     # -- Prefect Setup -- #
     logger = prefect.context.get("logger")
     # -- Prefect Setup -- #
-    logger.info("Transforming Data")
+    if 't' in run_style:
+        logger.info("Transforming Data")
     
-    global box, fred, us, state, master, datetime
+        global box, fred, registry, state_aliases, artifact_folder, us, state, master, datetime
     
-    try:
-        master = pd.concat([us, state])
-        master.loc[master['value'] == '.','value'] = '' # Replace with 0 instead?
-        
-        master['variable_name'] = master['variable'].replace(name_mapping)
-        master['variable_adjustment'] = master['variable'].replace(adjustment_mapping)
+        if 'e' not in run_style:
+            # Typed Parquet from the last extract
+            us = box.get_artifact(artifact_folder, 'fred_us.parquet')
+            state = box.get_artifact(artifact_folder, 'fred_state.parquet')
 
-        master_cols = ['date', 'geo_scope', 'geo_abbreviation', 'variable', 'variable_name', 'variable_adjustment', 'value']
-        master = master[master_cols]
+        try:
+            # value is already float64, with FRED's '.' missing marker as NaN (written as '' in the TSV)
+            # dems_fred holds the current vintage of each U.S. value, the earlier ones are kept in dems_fred_vintages
+            current = us.loc[us['realtime_end'] == '9999-12-31'].drop(columns = ['realtime_start', 'realtime_end'])
+            master = pd.concat([current, state], ignore_index = True)
+            master['variable'] = master['variable'].astype('str')
         
-        import getpass
-        master['data_loaded_on'] = datetime.now()
-        master['data_loaded_by'] = getpass.getuser()
-        logger.info(f"Combined Data Shape - {master.shape}")
+            master = registry.label(master, on = 'variable', aliases = state_aliases)
+            master = master.rename(columns = {'title' : 'variable_name', 'seasonal_adjustment' : 'variable_adjustment'})
+
+            master_cols = ['date', 'geo_scope', 'geo_abbreviation', 'variable', 'variable_name', 'variable_adjustment', 'value']
+            master = master[master_cols]
         
-        box.update_file('666718358067', master)
-        box.update_file('666715107631', master, sep='\t', index = False, header = False)
-        logger.info(f"Transformed Data uploaded to Box")
+            import getpass
+            master['data_loaded_on'] = datetime.now()
+            master['data_loaded_by'] = getpass.getuser()
+            logger.info(f"Combined Data Shape - {master.shape}")
         
-    except:
-        logger.error("Failed to tranform Data")
-        logger.error(json.dumps(sys.exc_info()[0]))
-        raise signals.FAIL() 
+        except:
+            logger.error("Failed to tranform Data")
+            logger.error(json.dumps(sys.exc_info()[0]))
+            raise signals.FAIL() 
+    else:
+        logger.info("T - Skipped")
         
 @task        
-def load_fred():
-    global ppy_sql, auth
+def load_fred(run_style, incremental):
+    global ppy_sql, ppy_schema, auth, box, artifact_folder, master, us, watermarks
     
-    db = ppy_sql.PostgreSQL(**auth.get_secret("dev/rds/postgresql"))
-    db.drop_table('dems_fred')
     # -- Prefect Setup -- #
     logger = prefect.context.get("logger")
     # -- Prefect Setup -- #
-    logger.info(f"Uploading data to {db.dbname}")
-
-    create_table_dems_fred = """
-        CREATE TABLE IF NOT EXISTS dems_fred(
-            fred_date DATE,
-            geo_scope TEXT,
-            geo_abbreviation TEXT,
-            variable TEXT,
-            variable_name TEXT,
-            variable_adjustment TEXT,
-            value DECIMAL,
-            data_loaded_on TIMESTAMP,
-            data_loaded_by TEXT
-        )
-    """
-    db.execute_commit(create_table_dems_fred)
-    
-    f = box.get_file('666715107631')
-    db.copy_from(f, 'dems_fred', sep='\t', null = '')
+    if 'l' in run_style:
+        db = ppy_sql.PostgreSQL(**auth.get_secret("dev/rds/postgresql"))
+        logger.info(f"Uploading data to {db.dbname}")
+
+        # Partitioned by date & indexed on its natural key (see ppy_schema)
+        schema = ppy_schema.dems_fred
+        schema.create(db)
+
+        # Load-only runs read the typed Parquet handed off by the last transform (see archive_fred),
+        # and the U.S. real-time periods from the last extract
+        if 't' not in run_style:
+            master = box.get_artifact(artifact_folder, 'fred_master.parquet')
+            us = box.get_artifact(artifact_folder, 'fred_us.parquet')
+
+        # Series ID as used by FRED & the watermark store, e.g. ICSA or AZICLAIMS
+        series_id = master['variable'].where(master['geo_scope'] != 'State', master['geo_abbreviation'] + master['variable'])
+        series_dates = pd.to_datetime(master['date']).groupby(series_id)
+
+        # dems_fred stays readable throughout: incremental runs merge the re-pulled window on the natural key,
+        # full runs build a new copy of the table, with its indexes built after the copy, and swap it in.
+        if incremental:
+            db.upsert_dataframe(master, 'dems_fred',
+                                keys = schema.natural_key,
+                                ignore = ['data_loaded_on', 'data_loaded_by'])
+        else:
+            db.swap_dataframe(master, 'dems_fred', schema = schema)
+
+        # Revision history -- each value is stored once per real-time period it was current for,
+        # so revisions are kept without storing a full copy per run. Read with db.as_of(...)
+        ppy_schema.dems_fred_vintages.create(db)
+
+        vintage_cols = ['date', 'geo_scope', 'geo_abbreviation', 'variable', 'value']
+        vintage_columns = ['fred_date', 'geo_scope', 'geo_abbreviation', 'variable', 'value']
+
+        # U.S. series carry ALFRED's real-time periods, so as_of reads return values as published
+        vintage = io.StringIO()
+        us[vintage_cols + ['realtime_start', 'realtime_end']].to_csv(vintage, sep = '\t', index = False, header = False)
+        vintage.seek(0)
+        db.merge_vintage(vintage, 'dems_fred_vintages',
+                         keys = schema.natural_key,
+                         columns = vintage_columns + ['realtime_start', 'realtime_end'], null = '')
+
+        # GeoFRED publishes no real-time periods, so state values are dated from the run which first saw them
+        vintage = io.StringIO()
+        master.loc[master['geo_scope'] == 'State', vintage_cols].to_csv(vintage, sep = '\t', index = False, header = False)
+        vintage.seek(0)
+        db.merge_vintage(vintage, 'dems_fred_vintages',
+                         keys = schema.natural_key,
+                         columns = vintage_columns,
+                         realtime_start = datetime.now().strftime('%Y-%m-%d'), null = '')
+
+        # Watermarks only move forward once the data has been loaded
+        if not db.last_error:
+            watermarks.update({k : v.strftime('%Y-%m-%d') for k,v in series_dates.max().items()})
+
+        # Returns the connection to the pool
+        db.disconnect()
     
-    logger.info(f"Data uploaded successfully")
+        logger.info(f"Data uploaded successfully")
+    else:
+        logger.info("L - Skipped")
+
+@task(trigger = always_run)
+def archive_fred(run_style, archive):
+    """Copies the transformed data to Box, as Parquet for load-only runs and, with archive, as CSV & TSV exports.
+       Runs after the load, even if it failed, so the load does not wait on Box uploads.
+    """
+    # -- Prefect Setup -- #
+    logger = prefect.context.get("logger")
+    # -- Prefect Setup -- #
+
+    global box, artifact_folder, master, us, state
+
+    if 't' not in run_style or 'master' not in globals():
+        logger.info("Archive - Skipped")
+        return
+
+    box.put_parquet(artifact_folder, master, 'fred_master.parquet')
+
+    if archive:
+        box.update_file('666718358067', master, streaming = True)
+        box.update_file('666715107631', master, sep='\t', index = False, header = False, streaming = True)
+        # U.S. & state exports, the U.S. file holding the current vintage only
+        box.update_file('666716428023', us.loc[us['realtime_end'] == '9999-12-31'].drop(columns = ['realtime_start', 'realtime_end']))
+        box.update_file('666717301983', state)
+    logger.info(f"Transformed Data uploaded to Box")
 
 cron = '15 13 * * THU'
 schedule = Schedule(clocks=[CronClock(cron)])
 with Flow("fred", schedule) as flow:
-    a, b, c, d = create_static_variables(), extract_fred(), transform_fred(), load_fred()
+    run_style = Parameter("run_style", default="etl")
+    incremental = Parameter("incremental", default=True)
+    archive = Parameter("archive", default=True)
+
+    a, b, c, d, e = create_static_variables(), extract_fred(run_style, incremental), transform_fred(run_style), load_fred(run_style, incremental), archive_fred(run_style, archive)
     flow.add_edge(a, b)
     flow.add_edge(b, c)
     flow.add_edge(c, d)
+    flow.add_edge(d, e)
 
 flow.register(project_name = "probitas-production")
 flow.run_agent()
\ No newline at end of file
@@ -4,60 +4,168 @@
 
 # -- Imports --------------------------------------------------------------------------------
 import sys, os, logging
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
+import time
+import sqlite3
+import asyncio
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
 import pandas as pd
+import requests
 
-from probitaspy.ppy_web import create_session
+from probitaspy.ppy_web import create_session, ResponseCache
+from probitaspy.web import AsyncClient
+from probitaspy.ppy_quota import KeyPool, RequestQueue, QuotaExceeded
 
 # -- API Objects ----------------------------------------------------------------------------
 
 # -- FRED ---------------------------------------------------------------------------------
 class FRED():
-    def __init__(self, api_key: str = '', debug = False):
-        
+    def __init__(self, api_key = '', debug = False, rate_limit: int = 120, rate_period: int = 60, concurrency: int = 10, cache: ResponseCache = None):
+        '''
+        api_key -- an API key, or a list of keys (e.g. from ppy_auth.Auth.get_keys) to spread requests over
+        rate_limit / rate_period -- requests allowed per key per period (seconds)
+        '''
         self.api_key = api_key
+        self.cache = cache
         
         self.file_type = 'json'
         self.url_base = 'https://api.stlouisfed.org/fred/'
-        self.base_params = {'api_key' : self.api_key, 'file_type' : self.file_type}
+        self.geofred_url_base = 'https://api.stlouisfed.org/geofred/'
+        self.region_scopes = {'state' : 'State', 'county' : 'County', 'msa' : 'Metropolitan Area', 'bea' : 'BEA Region', 'censusregion' : 'Census Region', 'censusdivision' : 'Census Division', 'country' : 'Country'}
+        # api_key is added per request, from the key pool
+        self.base_params = {'file_type' : self.file_type}
+        # Most observations FRED returns per series/observations response (its limit parameter)
+        self.observation_limit = 100000
         self.url_options = {
             'series' : ['categories', 'observation', 'release', 'search']
             }
         
         self.configure_session()
+
+        # FRED allows 120 requests per minute per key, so each key of the pool has its own token bucket
+        self.rate_limit = rate_limit
+        self.rate_period = rate_period
+        self.concurrency = concurrency
+        keys = [api_key] if isinstance(api_key, str) else list(api_key)
+        self.keys = KeyPool('fred', keys or [''], rate_limit = rate_limit, rate_period = rate_period)
         
         self.debug = debug
         if self.debug:
             print("debugger | debugging enabled")
 
     def configure_session(self):
-        self.r = create_session(timeout = 15)
+        self.r = create_session(timeout = 15, cache = self.cache)
     
-    def query_url(self, endpoint_url: str, params: dict):
-        payload = {**params, **self.base_params}
-        url = self.url_base + endpoint_url
-        try:
-            response = self.r.get(url, params = payload)
-            if self.debug:
-                print(f"debugger | {endpoint_url} | {response.url}")
-            response = response.json()
-            return(response)
-        except:
-            ("Error.", {'url':url,'params':params})
+    def query_url(self, endpoint_url: str, params: dict, url_base: str = None):
+        url = (url_base or self.url_base) + endpoint_url
+        # A key FRED keeps rate-limiting (429) is set aside for a rate period, and the request retried with another
+        for attempt in range(len(self.keys.keys)):
+            key = self.keys.acquire()
+            payload = {**params, **self.base_params, 'api_key' : key}
+            try:
+                response = self.r.get(url, params = payload)
+                if self.debug:
+                    print(f"debugger | {endpoint_url} | {url}")
+                response = response.json()
+                return(response)
+            except (requests.exceptions.RetryError, requests.exceptions.HTTPError) as e:
+                status = getattr(e.response, 'status_code', None)
+                if status == 429 or '429' in str(e):
+                    self.keys.throttle(key, self.rate_period)
+                    continue
+                print("Error.", {'url':url,'params':params})
+                return(None)
+            except:
+                print("Error.", {'url':url,'params':params})
+                return(None)
+        print(f"Error. All {len(self.keys.keys)} FRED keys rate-limited (429)", {'url':url,'params':params})
+        return(None)
 
     def series_search(self, search_text: str):
         url = 'series/search'
         response = self.query_url(url, {'search_text':search_text})
         return(response)
     
-    def series_observations(self, search_text: str, scope: str = 'national'):
-        url = 'series/observations'
+    def series_info(self, search_text: str):
+        '''
+        Returns the fred/series metadata for a series ID (title, units, frequency, seasonal_adjustment, ...)
+        '''
+        url = 'series'
         response = self.query_url(url, {'series_id':search_text})
         try:
-            response = response['observations']
-            response = pd.DataFrame(response)
+            return(response['seriess'][0])
+        except:
+            print(f'Error in series_info func | {search_text}')
+            print(response)
+
+    def vintage_params(self, realtime_start: str = None, realtime_end: str = None, vintage_dates = None) -> dict:
+        '''
+        Builds the ALFRED real-time period parameters for series/observations.
+        When any are set, observations come back once per real-time period in which their value was
+        unchanged (output_type 1), so only revised values add rows.
+
+        realtime_start / realtime_end -- YYYY-MM-DD, e.g. '1776-07-04' & '9999-12-31' for every vintage
+        vintage_dates -- a YYYY-MM-DD date or list of dates, returning the data as it stood on each
+        '''
+        params = {}
+        if realtime_start:
+            params['realtime_start'] = realtime_start
+        if realtime_end:
+            params['realtime_end'] = realtime_end
+        if vintage_dates:
+            if not isinstance(vintage_dates, str):
+                vintage_dates = ','.join(vintage_dates)
+            params['vintage_dates'] = vintage_dates
+        if params:
+            params['output_type'] = 1
+        return(params)
+
+    def series_observations(self, search_text: str, scope: str = 'national', observation_start: str = None, realtime_start: str = None, realtime_end: str = None, vintage_dates = None):
+        '''
+        observation_start -- optional YYYY-MM-DD date, only observations on or after it are returned
+        realtime_start, realtime_end, vintage_dates -- optional ALFRED real-time period, see vintage_params.
+                                                       The realtime_start/realtime_end columns are kept when set
+        '''
+        url = 'series/observations'
+        params = {'series_id':search_text, **self.vintage_params(realtime_start, realtime_end, vintage_dates)}
+        if observation_start:
+            params['observation_start'] = observation_start
+        # FRED returns at most observation_limit observations per response, so long vintage histories are paged
+        pages = []
+        while True:
+            page = self.query_url(url, {**params, 'limit' : self.observation_limit, 'offset' : self.observations_read(pages)})
+            if page is None:
+                return(None)
+            pages.append(page)
+            if self.observations_read(pages) >= page.get('count', 0) or not page.get('observations'):
+                break
+        return(self.parse_observations(self.join_pages(pages), search_text, scope, realtime = 'output_type' in params))
+
+    def observations_read(self, pages: list) -> int:
+        return(sum(len(page.get('observations', [])) for page in pages))
+
+    def join_pages(self, pages: list) -> dict:
+        '''
+        Combines the pages of a series/observations response into one response
+        '''
+        return({**pages[0], 'observations' : [o for page in pages for o in page.get('observations', [])]})
+
+    def parse_observations(self, response: dict, search_text: str, scope: str = 'national', realtime: bool = False):
+        '''
+        Converts a series/observations JSON response into a typed DataFrame labelled by scope.
+        Only date (datetime64) and value (float64, FRED's '.' missing marker becomes NaN) are kept.
+        The realtime_start/realtime_end columns are dropped unless realtime is set; they stay as YYYY-MM-DD
+        strings, as ALFRED's open-ended bounds (1776-07-04, 9999-12-31) are outside the datetime64 range.
+        '''
+        try:
+            columns = ['date', 'value'] + (['realtime_start', 'realtime_end'] if realtime else [])
+            response = pd.DataFrame(response['observations'], columns = columns)
+            response['date'] = pd.to_datetime(response['date'], format = '%Y-%m-%d')
+            response['value'] = pd.to_numeric(response['value'].mask(response['value'] == '.'))
             if scope == 'national':
                 response['variable'] = search_text
                 response['geo_scope'] = 'National'
@@ -73,7 +181,145 @@ class FRED():
             print(f'Error in series_obsevations func | {search_text}')
             print(sys.exc_info())
             print(response)
+
+    def series_observations_batch(self, series_ids: list, scope: str = 'national', observation_start = None, realtime_start: str = None, realtime_end: str = None, vintage_dates = None):
+        '''
+        Fetches series/observations for every series ID concurrently, sharing one AsyncClient
+        connection pool and throttled per key of the pool (self.rate_limit per self.rate_period each).
+        Series which fail are reported and skipped.
+
+        observation_start -- a YYYY-MM-DD date applied to every series, or a dict of {series_id : date}
+                             (e.g. from ppy_watermarks.Watermarks.start_dates); None pulls full history
+        realtime_start, realtime_end, vintage_dates -- optional ALFRED real-time period, see vintage_params
+
+        >>> fred.series_observations_batch(['AZICLAIMS', 'CAICLAIMS'], scope = 'state')
+        '''
+        if not isinstance(observation_start, dict):
+            observation_start = {series_id : observation_start for series_id in series_ids}
+        vintage = self.vintage_params(realtime_start, realtime_end, vintage_dates)
+        frames = asyncio.run(self._series_observations_async(series_ids, scope, observation_start, vintage))
+        frames = [f for f in frames if f is not None]
+        if not frames:
+            return(pd.DataFrame())
+        frames = pd.concat(frames, ignore_index = True)
+        # Labels repeat for every observation of a series, so store them as categoricals
+        for col in ['variable', 'geo_scope', 'geo_abbreviation']:
+            if col in frames:
+                frames[col] = frames[col].astype('category')
+        return(frames)
+
+    async def _series_observations_async(self, series_ids: list, scope: str, observation_start: dict, vintage: dict = None):
+        client = AsyncClient(limit = self.concurrency, logname = 'fred_async.log', keep_alive = True)
+        try:
+            tasks = [self._fetch_observations(client, series_id, scope, observation_start.get(series_id), vintage) for series_id in series_ids]
+            return(await asyncio.gather(*tasks))
+        finally:
+            await client.close()
+
+    async def _fetch_observations(self, client: AsyncClient, series_id: str, scope: str, observation_start: str = None, vintage: dict = None):
+        vintage = vintage or {}
+        payload = {'series_id' : series_id, **vintage, **self.base_params, 'limit' : self.observation_limit}
+        realtime = 'output_type' in vintage
+        if observation_start:
+            payload['observation_start'] = observation_start
+
+        # Pages of observation_limit observations until the response's count is read
+        pages = []
+        while True:
+            url = self.url_base + 'series/observations?' + urlencode({**payload, 'offset' : self.observations_read(pages)})
+            page = await self._fetch_page(client, url, series_id)
+            if page is None:
+                return(None)
+            pages.append(page)
+            if self.observations_read(pages) >= page.get('count', 0) or not page.get('observations'):
+                break
+        return(self.parse_observations(self.join_pages(pages), series_id, scope, realtime))
+
+    async def _fetch_page(self, client: AsyncClient, url: str, series_id: str):
+        # Cache keys leave out the API key, so entries are shared by every key of the pool
+        if self.cache is not None:
+            key = self.cache.make_key('GET', url)
+            cached = self.cache.get(key, url)
+            if cached is not None:
+                return(json.loads(cached[2]))
+
+        api_key = await self.keys.acquire_async()
+        response = await client.get(url + '&' + urlencode({'api_key' : api_key}), response_format = 'text')
+        if self.debug:
+            print(f"debugger | series/observations | {series_id}")
+        if response is None:
+            print(f'Error in series_observations_batch func | {series_id}')
+            return(None)
+        if self.cache is not None:
+            self.cache.set(key, url, 200, {'Content-Type' : 'application/json'}, response.encode('utf-8'))
+        return(json.loads(response))
             
+    def series_group(self, search_text: str):
+        '''
+        Returns the GeoFRED series group metadata for a series ID (series_group, region_type, season, units, frequency, min_date, max_date)
+        '''
+        url = 'series/group'
+        response = self.query_url(url, {'series_id':search_text}, url_base = self.geofred_url_base)
+        try:
+            return(response['series_group'])
+        except:
+            print(f'Error in series_group func | {search_text}')
+            print(response)
+
+    def regional_data(self, search_text: str, variable: str = None, region_type: str = None, start_date: str = None, end_date: str = None, geo_mapping: dict = None):
+        '''
+        Pulls one indicator for every region (all states, counties or MSAs) in a single GeoFRED regional/data request,
+        instead of one series/observations request per region. Returns the long format of series_observations:
+        date, geo_scope, geo_abbreviation, variable, value
+
+        search_text -- any series in the group, e.g. 'ALICLAIMS' for state initial claims
+        variable -- label for the variable column, defaults to search_text
+        region_type -- 'state', 'county', 'msa', ...; defaults to the region type of the series group
+        start_date / end_date -- YYYY-MM-DD, default to the full history of the group
+        geo_mapping -- optional {region code : abbreviation}, e.g. state FIPS to postal codes. Regions missing
+                       from the mapping are dropped. Without it, geo_abbreviation is GeoFRED's region code
+
+        >>> fred.regional_data('ALICLAIMS', variable = 'ICLAIMS', geo_mapping = {'01' : 'AL', '04' : 'AZ'})
+        '''
+        group = self.series_group(search_text)
+        if not group:
+            return(None)
+        region_type = region_type or group['region_type']
+
+        params = {
+            'series_group' : group['series_group'],
+            'region_type' : region_type,
+            'date' : end_date or group['max_date'],
+            'start_date' : start_date or group['min_date'],
+            'season' : group['season'],
+            'units' : group['units'],
+            'frequency' : group['frequency'],
+            'transformation' : 'lin'
+            }
+        response = self.query_url('regional/data', params, url_base = self.geofred_url_base)
+        try:
+            data = response['meta']['data']
+            records = [(date, str(item['code']), item['value']) for date, items in data.items() for item in (items or [])]
+            response = pd.DataFrame.from_records(records, columns = ['date', 'code', 'value'])
+            response['date'] = pd.to_datetime(response['date'], format = '%Y-%m-%d')
+            response['value'] = pd.to_numeric(response['value'], errors = 'coerce')
+
+            if geo_mapping is not None:
+                response['geo_abbreviation'] = response['code'].map(geo_mapping)
+                response = response.loc[response['geo_abbreviation'].notnull()]
+            else:
+                response['geo_abbreviation'] = response['code']
+            response['geo_scope'] = self.region_scopes.get(region_type, region_type)
+            response['variable'] = variable or search_text
+
+            response = response[['date', 'geo_scope', 'geo_abbreviation', 'variable', 'value']].reset_index(drop = True)
+            for col in ['geo_scope', 'geo_abbreviation', 'variable']:
+                response[col] = response[col].astype('category')
+            return(response)
+        except:
+            print(f'Error in regional_data func | {search_text}')
+            print(sys.exc_info())
+
     def generate_fred_codes(self, abbreviation_state):
         '''
         Provided a state abbreviation_stateabbreviation_state, generates the state's initial claims FRED Series ID 
@@ -100,12 +346,113 @@ class FRED():
 
         return(response)
     
+class SeriesRegistry():
+    '''
+    Local cache of FRED series metadata from the fred/series endpoint, stored in SQLite.
+    Entries older than max_age_days are re-fetched on the next lookup, so adding a series needs no hard-coded labels.
+
+    >>> registry = SeriesRegistry(fred)
+    >>> registry.metadata(['ICSA', 'GDP'])
+    '''
+    fields = ['title', 'units', 'frequency', 'seasonal_adjustment', 'last_updated']
+
+    def __init__(self, fred: FRED, path: str = '', max_age_days: int = 30):
+        self.fred = fred
+        self.path = path or os.path.join(os.getcwd(), 'fred_series.sqlite')
+        self.max_age_days = max_age_days
+
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute(f'''
+            CREATE TABLE IF NOT EXISTS series(
+                series_id TEXT PRIMARY KEY,
+                {', '.join(f + ' TEXT' for f in self.fields)},
+                fetched_on TEXT
+            )
+            ''')
+        self.connection.commit()
+
+    def stale(self, series_ids: list) -> list:
+        '''
+        Returns the series IDs which are missing from the registry, or older than max_age_days
+        '''
+        cutoff = (datetime.now() - timedelta(days = self.max_age_days)).isoformat()
+        fresh = self.connection.execute('SELECT series_id FROM series WHERE fetched_on >= ?', (cutoff,)).fetchall()
+        fresh = {r[0] for r in fresh}
+        return([s for s in series_ids if s not in fresh])
+
+    def refresh(self, series_ids: list) -> None:
+        fetched_on = datetime.now().isoformat()
+        rows = []
+        for series_id in series_ids:
+            info = self.fred.series_info(series_id)
+            if info:
+                rows.append([series_id] + [info.get(f) for f in self.fields] + [fetched_on])
+        self.connection.executemany(
+            f'INSERT OR REPLACE INTO series VALUES ({", ".join("?" * (len(self.fields) + 2))})', rows)
+        self.connection.commit()
+
+    def metadata(self, series_ids: list, aliases: dict = None) -> pd.DataFrame:
+        '''
+        Returns metadata indexed by code, with categorical columns. Stale entries are refreshed first.
+
+        aliases -- {code : series_id}, for codes which are not FRED series themselves. The code takes the
+                   metadata of the series, with the trailing geography removed from the title, e.g.
+                   {'ICLAIMS' : 'ALICLAIMS'} labels ICLAIMS "Initial Claims" rather than "Initial Claims in Alabama"
+        '''
+        aliases = aliases or {}
+        lookup = {code : aliases.get(code, code) for code in series_ids}
+        stale = self.stale(list(set(lookup.values())))
+        if stale:
+            self.refresh(stale)
+
+        placeholders = ', '.join('?' * len(lookup))
+        meta = pd.read_sql_query(
+            f'SELECT series_id, {", ".join(self.fields)} FROM series WHERE series_id IN ({placeholders})',
+            self.connection, params = list(set(lookup.values())))
+        meta = meta.set_index('series_id')
+
+        codes = pd.Series(lookup, name = 'series_id')
+        meta = meta.reindex(codes.values).set_axis(codes.index)
+        aliased = meta.index.isin(list(aliases))
+        meta.loc[aliased, 'title'] = meta.loc[aliased, 'title'].str.rsplit(' in ', n = 1).str[0]
+        meta.index.name = 'code'
+        return(meta.astype('category'))
+
+    def label(self, df: pd.DataFrame, on: str = 'variable', aliases: dict = None) -> pd.DataFrame:
+        '''
+        Joins the metadata columns onto df by its code column, in a single vectorized merge
+
+        >>> registry.label(master, on = 'variable', aliases = {'ICLAIMS' : 'ALICLAIMS'})
+        '''
+        meta = self.metadata(list(df[on].unique()), aliases)
+        return(df.merge(meta, how = 'left', left_on = on, right_index = True))
+
 # -- BLS ----------------------------------------------------------------------------------
 class BLS():
-    def __init__(self, api_key: str = ''):
-        self.r = create_session()
+    def __init__(self, api_key = '', cache: ResponseCache = None, daily_limit: int = 500, quota_path: str = ''):
+        '''
+        api_key -- a registration key, or a list of keys (e.g. from ppy_auth.Auth.get_keys) to spread requests over.
+                   Without a key, requests are unregistered, with BLS' lower limits
+        daily_limit -- requests allowed per key per day
+        '''
+        self.cache = cache
+        self.r = create_session(cache = cache)
         self.headers = {'Content-type': 'application/json'}
         self.api_key = api_key
+        self.url = 'https://api.bls.gov/publicAPI/v2/timeseries/data/'
+
+        keys = [k for k in ([api_key] if isinstance(api_key, str) else api_key) if k]
+        self.registered = bool(keys)
+        # BLS v2 limits per request & per day, for registered keys (unregistered requests allow less)
+        self.max_series = 50 if self.registered else 25
+        self.max_years = 20 if self.registered else 10
+        self.daily_limit = daily_limit if self.registered else 25
+        self.requests_made = 0
+
+        # Requests per key per day persist across runs; requests beyond the quota of every key wait in the queue for the next day
+        self.keys = KeyPool('bls', keys or [''], daily_limit = self.daily_limit, path = quota_path)
+        self.ledger = self.keys.ledger
+        self.queue = RequestQueue('bls', path = quota_path)
 
     def generate_laus(self, fips_state):
         '''
@@ -165,7 +512,7 @@ class BLS():
         
         return(response)
 
-    def get_series(self, series_list, start_year = str(int(datetime.strftime(datetime.now(),"%Y"))-10), end_year = datetime.strftime(datetime.now(),"%Y")):
+    def get_series(self, series_list, start_year = None, end_year = None):
         '''
         Code originally from: https://www.bls.gov/developers/api_python.htm#python2
         Modified by: Hamza Amjad
@@ -174,38 +521,295 @@ class BLS():
         start_year -- start year for data pull, defaults to ten years in the past
         end_year -- end year for data pull, defaults to today's year
 
+        Returns one long DataFrame for all series (see parse_series)
+
         >>> get_series(generate_laus('04')['laus'])
         '''
+        # Defaults are computed per call, not once at import, so long-running agents stay current
+        end_year = end_year or datetime.now().year
+        start_year = start_year or int(end_year) - 10
         
-        data = json.dumps({
-            "seriesid": series_list,
-            "startyear": start_year, "endyear": end_year,
-            "registrationkey" :  '302aea9fa5ad4faa9ec5114111b6add1' # Your key here...
-            })
-        p = self.r.post('https://api.bls.gov/publicAPI/v2/timeseries/data/', data=data, headers=self.headers)
+        json_data = self.post_series(series_list, start_year, end_year)
         try:
-            json_data = json.loads(p.text)
             if json_data['status'] == 'REQUEST_NOT_PROCESSED':
                 print(json_data['status'])
                 print(json_data['message'])
                 return(json_data)
             else:
-                series_data = {k['seriesID']:'' for k in json_data['Results']['series']}
-                for series in json_data['Results']['series']:
-                    data = list()
-                    series_id = series['seriesID']
-                    for item in series['data']:
-                        year = item['year']
-                        period = item['period']
-                        value = item['value']
-                        footnotes = ""
-                        for footnote in item['footnotes']:
-                            if footnote:
-                                footnotes = footnotes + footnote['text'] + ','
-                        if 'M01' <= period <= 'M12':
-                            data.append({'series_id' : series_id, 'year' : year, 'period' : period, 'value' : value, 'footnotes' : footnotes[0:-1]})
-                    data = pd.DataFrame.from_dict(data)
-                    series_data[series_id] = data
+                series_data = self.parse_series(json_data)
         except:
-            series_data = p.text
-        return(series_data)
\ No newline at end of file
+            series_data = json_data
+        return(series_data)
+
+    def post_series(self, series_list, start_year = None, end_year = None, latest: bool = False):
+        '''
+        Makes a single timeseries/data request, returning the JSON payload (or the raw text if it is not JSON)
+        latest -- request only the most recent observation of each series, ignoring the years
+        A cached response is returned without using any quota. Otherwise the request takes the next key of
+        the pool with quota left (see ppy_quota.KeyPool), and is counted against it before it is sent.
+        A key BLS reports as over its daily threshold is skipped for the rest of the day & the request retried
+        with another; QuotaExceeded is raised once every key is used up.
+        '''
+        request = {"seriesid": series_list}
+        if latest:
+            request["latest"] = True
+        else:
+            request.update({"startyear": str(start_year), "endyear": str(end_year)})
+
+        cached = self.cached_response(request)
+        if cached is not None:
+            return(json.loads(cached))
+
+        while True:
+            registration_key = self.keys.acquire()
+            data = dict(request)
+            if registration_key:
+                data["registrationkey"] = registration_key
+            data = json.dumps(data)
+            p = self.r.post(self.url, data=data, headers=self.headers)
+            if getattr(p, 'from_cache', False):
+                self.keys.release(registration_key)
+            else:
+                self.requests_made += 1
+            try:
+                json_data = json.loads(p.text)
+            except:
+                return(p.text)
+            if json_data.get('status') == 'REQUEST_NOT_PROCESSED':
+                # BLS reports failures with a 200 status, so keep them out of the cache
+                if self.cache is not None:
+                    self.cache.delete(self.cache.make_key('POST', self.url, data))
+                message = ' '.join(json_data.get('message', []))
+                if 'threshold' in message.lower():
+                    print(f'Daily quota | BLS reports key {self.keys.key_id(registration_key)} used up')
+                    self.keys.exhaust(registration_key)
+                    continue
+            return(json_data)
+
+    def parse_series(self, json_data: dict) -> pd.DataFrame:
+        '''
+        Converts a timeseries/data JSON payload into one long DataFrame of monthly observations for all series:
+            series_id -- categorical
+            year, month -- small integers (annual averages, M13, are dropped)
+            value -- float, with BLS' '-' and '(n)' markers (or any other non-numeric value) as NaN
+            footnotes -- categorical, the footnote texts joined by ','
+        '''
+        # Built column-wise from all records at once, each series' ID repeated over its observations
+        series = json_data['Results']['series']
+        frame = pd.DataFrame.from_records([item for s in series for item in s['data']], columns = ['year', 'period', 'value', 'footnotes'])
+        frame['series_id'] = np.repeat([s['seriesID'] for s in series], [len(s['data']) for s in series])
+        frame = frame.loc[frame['period'].str.startswith('M') & (frame['period'] != 'M13')]
+
+        # Only a few distinct footnote lists occur, so each is joined once and gathered per row
+        codes, _ = pd.factorize(frame['footnotes'].astype('str'))
+        _, first = np.unique(codes, return_index = True)
+        texts = np.array([','.join(f['text'] for f in frame['footnotes'].iat[i] if f) for i in first], dtype = 'object')
+
+        frame = pd.DataFrame({
+            'series_id' : frame['series_id'].astype('category'),
+            'year' : frame['year'].astype('int16'),
+            'month' : frame['period'].str[1:].astype('int8'),
+            'value' : pd.to_numeric(frame['value'], errors = 'coerce'),
+            'footnotes' : pd.Categorical(texts[codes])
+            }).reset_index(drop = True)
+        return(frame)
+
+    def normalize(self, df: pd.DataFrame, sentinels: tuple = ('-', '(n)')) -> pd.DataFrame:
+        '''
+        Normalizes a long LAUS frame (API and/or MSA rows) in vectorized steps:
+            year, month -- small integers; rows without a valid year & month are dropped
+            date -- the first of the month, built arithmetically from year & month (datetime64)
+            value -- parsed numerically once, with BLS' sentinels (and any other text) as NaN
+            fips_state / fips_area -- compact integers, fips_area nullable as national & state rows have none
+            other text columns -- categoricals
+
+        >>> bls.normalize(pd.concat([us_employment, state_employment, msa_employment]))
+        '''
+        df = df.copy()
+        df['year'] = pd.to_numeric(df['year'], errors = 'coerce')
+        df['month'] = pd.to_numeric(df['month'], errors = 'coerce')
+        df = df.loc[df['year'].notnull() & df['month'].between(1, 12)]
+        df['year'] = df['year'].astype('int16')
+        df['month'] = df['month'].astype('int8')
+
+        # Months since 1970-01 viewed as datetime64[M], avoiding string formatting & parsing
+        months = (df['year'].to_numpy('int64') - 1970) * 12 + df['month'].to_numpy('int64') - 1
+        df['date'] = months.view('datetime64[M]').astype('datetime64[ns]')
+
+        value = df['value']
+        if not pd.api.types.is_numeric_dtype(value):
+            value = value.mask(value.isin(sentinels))
+        df['value'] = pd.to_numeric(value, errors = 'coerce')
+
+        df['fips_state'] = pd.to_numeric(df['fips_state']).astype('int8')
+        if 'fips_area' in df:
+            df['fips_area'] = pd.to_numeric(df['fips_area'], errors = 'coerce').astype('Int32')
+
+        for col in df.columns:
+            if pd.api.types.is_string_dtype(df[col].dtype):
+                df[col] = df[col].astype('category')
+        return(df.reset_index(drop = True))
+
+    def plan_requests(self, series_list: list, start_year, end_year = None) -> list:
+        '''
+        Packs series IDs & a year range into the fewest valid requests: at most self.max_series series
+        and self.max_years years each. Duplicate series IDs are requested once.
+        end_year defaults to the current year, so backfill windows extend as time passes.
+
+        >>> bls.plan_requests(['LNS11000000', 'LNS12000000'], 1990, 2020)
+        [{'seriesid': ['LNS11000000', 'LNS12000000'], 'startyear': '1990', 'endyear': '2009'},
+         {'seriesid': ['LNS11000000', 'LNS12000000'], 'startyear': '2010', 'endyear': '2020'}]
+        '''
+        start_year, end_year = int(start_year), int(end_year or datetime.now().year)
+        series_list = list(dict.fromkeys(series_list))
+        windows = [(y, min(y + self.max_years - 1, end_year)) for y in range(start_year, end_year + 1, self.max_years)]
+        chunks = [series_list[i:i + self.max_series] for i in range(0, len(series_list), self.max_series)]
+        return([{'seriesid' : c, 'startyear' : str(y0), 'endyear' : str(y1)} for c in chunks for (y0, y1) in windows])
+
+    def get_series_batch(self, series_list: list, start_year, end_year = None, concurrency: int = 4, job: str = 'default', wait: bool = False) -> pd.DataFrame:
+        '''
+        Fetches any number of series over any year range, using the fewest requests (see plan_requests),
+        run concurrently. Only this call's plan is run: requests beyond the remaining daily quota (or which
+        fail) are added to the job's queue of deferred requests, to be resumed with run_deferred.
+        Returns one DataFrame with the columns of get_series.
+
+        >>> bls.get_series_batch(laus_series_ids, 1990, 2020)
+        '''
+        plan = self.plan_requests(series_list, start_year, end_year)
+        self.queue.add(job, plan)
+        return(self.run_requests(job, plan, concurrency = concurrency, wait = wait))
+
+    def run_deferred(self, job: str = 'default', concurrency: int = 4, wait: bool = False) -> pd.DataFrame:
+        '''
+        Runs the job's queued requests, oldest first, within the remaining daily quota. Requests left over
+        (or refused with QuotaExceeded) stay queued, so the next call resumes them; with wait, this instead
+        sleeps until the quota resets and carries on until the queue is empty.
+        Returns one DataFrame with the columns of get_series.
+
+        >>> bls.run_deferred()   # e.g. the first step of a daily run, finishing yesterday's backfill
+        '''
+        return(self.run_requests(job, concurrency = concurrency, wait = wait))
+
+    def run_requests(self, job: str, requests: list = None, concurrency: int = 4, wait: bool = False) -> pd.DataFrame:
+        '''
+        Runs the given requests of the job's queue (all of them by default) which are still pending,
+        see run_deferred
+        '''
+        ids = None if requests is None else {self.queue.request_id(r) for r in requests}
+        frames = []
+        while True:
+            pending = [r for r in self.queue.pending(job) if ids is None or self.queue.request_id(r) in ids]
+            remaining = self.keys.remaining()
+            # Cached responses use no quota, so only the other requests are limited to what is left of it
+            hits = [self.cached_response(r) is not None for r in pending]
+            cached = [r for r, hit in zip(pending, hits) if hit]
+            uncached = [r for r, hit in zip(pending, hits) if not hit]
+            plan = cached + uncached[:remaining]
+            if len(uncached) > remaining:
+                print(f'Daily quota | {len(uncached)} requests pending, {remaining} remaining. Deferring {len(uncached) - remaining} until {self.ledger.resets_at().isoformat()}')
+
+            with ThreadPoolExecutor(max_workers = concurrency) as pool:
+                frames += [f for f in pool.map(lambda req: self.run_request(job, req), plan) if f is not None]
+
+            if not wait or not [r for r in self.queue.pending(job) if ids is None or self.queue.request_id(r) in ids]:
+                break
+            pause = (self.ledger.resets_at() - datetime.now(self.ledger.timezone)).total_seconds()
+            print(f'Daily quota | waiting {pause / 3600:.1f} hours for the quota to reset')
+            time.sleep(max(pause, 0) + 60)
+        return(self.concat_series(frames))
+
+    def run_request(self, job: str, req: dict):
+        '''
+        Makes one planned request, removing it from the job's queue once its response is parsed.
+        Requests refused by the quota, or whose response fails, stay queued. Returns the parsed frame, or None.
+        '''
+        try:
+            json_data = self.post_series(req['seriesid'], req['startyear'], req['endyear'])
+        except QuotaExceeded as e:
+            print(f'Deferred | {e}')
+            return(None)
+        try:
+            if json_data['status'] == 'REQUEST_NOT_PROCESSED':
+                print(json_data['status'], json_data['message'], req['startyear'], req['endyear'])
+                return(None)
+            frame = self.parse_series(json_data)
+        except:
+            print(f'Error in get_series_batch func | {req}')
+            print(json_data)
+            return(None)
+        self.queue.done(job, req)
+        return(frame)
+
+    def concat_series(self, frames: list) -> pd.DataFrame:
+        '''
+        Concatenates parse_series frames, keeping series_id & footnotes categorical
+        '''
+        frames = [f for f in frames if len(f)]
+        if not frames:
+            return(pd.DataFrame(columns = ['series_id', 'year', 'month', 'value', 'footnotes']))
+        frames = pd.concat(frames, ignore_index = True)
+        for col in ['series_id', 'footnotes']:
+            frames[col] = frames[col].astype('category')
+        return(frames)
+
+    def cached_response(self, request: dict):
+        '''
+        Returns the cached body of a timeseries/data request, or None. Cache keys leave out the registration key,
+        so the lookup needs no key from the pool
+        '''
+        if self.cache is None:
+            return(None)
+        cached = self.cache.get(self.cache.make_key('POST', self.url, json.dumps(request)), self.url)
+        return(None if cached is None else cached[2])
+
+    def get_series_latest(self, series_list: list) -> dict:
+        '''
+        Returns the most recent monthly observation date of each series as {series_id : 'YYYY-MM-01'},
+        using one "latest" request per self.max_series series. Once the daily quota is used up, the series
+        left are omitted
+        '''
+        series_list = list(dict.fromkeys(series_list))
+        latest = {}
+        for i in range(0, len(series_list), self.max_series):
+            try:
+                json_data = self.post_series(series_list[i:i + self.max_series], latest = True)
+            except QuotaExceeded as e:
+                print(f'Latest | {len(series_list) - i} series unchecked | {e}')
+                break
+            try:
+                if json_data['status'] == 'REQUEST_NOT_PROCESSED':
+                    print(json_data['status'], json_data['message'])
+                    continue
+                for row in self.parse_series(json_data).itertuples():
+                    latest[row.series_id] = f"{row.year}-{row.month:02d}-01"
+            except:
+                print(f'Error in get_series_latest func')
+                print(json_data)
+        return(latest)
+
+    def get_series_incremental(self, series_list: list, watermarks, lookback_months: int = 12, backfill_start = 1990) -> pd.DataFrame:
+        '''
+        Fetches only what is new since each series' watermark (a ppy_watermarks.Watermarks):
+            0. "latest" requests find the series with a release newer than their watermark; series the quota
+               left unchecked are treated as new, so they are planned & deferred rather than skipped
+            1. Those are fetched from the year of (watermark - lookback_months), to capture revisions;
+               series without a watermark are backfilled from backfill_start
+            2. Series are grouped by start year, so each group is packed into the fewest requests
+        Returns one DataFrame with the columns of get_series. Watermarks are not updated here,
+        store them with watermarks.update once the data has been loaded.
+
+        >>> bls.get_series_incremental(laus_series_ids, ppy_watermarks.Watermarks('bls'))
+        '''
+        marks = watermarks.get_all()
+        latest = self.get_series_latest([s for s in series_list if s in marks])
+        stale = [s for s in series_list if marks.get(s) is None or latest.get(s) is None or latest[s] > marks[s]]
+        print(f'Incremental | {len(stale)} of {len(series_list)} series have new data')
+
+        starts = watermarks.start_dates(stale, lookback_days = lookback_months * 31)
+        groups = {}
+        for series_id in stale:
+            start_year = int(starts[series_id][:4]) if starts.get(series_id) else int(backfill_start)
+            groups.setdefault(start_year, []).append(series_id)
+
+        frames = [self.get_series_batch(ids, start_year) for start_year, ids in sorted(groups.items())]
+        return(self.concat_series(frames))
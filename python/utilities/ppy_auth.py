@@ -70,4 +70,20 @@ class Auth():
                 return(secret)
             else:
                 decoded_binary_secret = base64.b64decode(get_secret_value_response['SecretBinary'])
-                return(decoded_binary_secret)
\ No newline at end of file
+                return(decoded_binary_secret)
+
+    def get_keys(self, secret_name : str = '', names : list = None) -> list:
+        """Given the name of a AWS Secrets Manager Secret holding several API keys as {name : key},
+           returns the keys as a list, e.g. for a ppy_quota.KeyPool. names selects a subset of the keys.
+
+           Example:
+            >>> Auth.get_keys("dev/api/bls")
+            ['key_1', 'key_2']
+            >>> Auth.get_keys("dev/api/bls", names = ['key'])
+            ['key_1']
+        """
+        secret = self.get_secret(secret_name)
+        if isinstance(secret, str):
+            return([secret])
+        names = names or list(secret.keys())
+        return([secret[n] for n in names if secret.get(n)])
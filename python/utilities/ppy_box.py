@@ -1,9 +1,12 @@
 import os, logging
-import io
+import io, gzip, shutil, hashlib, tempfile, threading
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 
 from boxsdk import JWTAuth, Client, exception
 
+from probitaspy.ppy_io import ChunkedStream
+
 from pprint import pprint
 
 # -- Box ------------------------------------------------------------------------------------------------
@@ -31,6 +34,9 @@ class ProbitasBox():
         self.uploaded_files = {}
         self.updated_files = {}
         
+        # Box only accepts chunked upload sessions for files of at least 20MB
+        self.chunked_upload_min = 20000000
+        
     def get_info(self):
         print(f"Username: {self.user.name}")
         print(f"User ID : {self.user.id}")
@@ -48,6 +54,13 @@ class ProbitasBox():
         folder_id = self.static_folders.get('data').get('sub_folders').get(folder_name).get('folder_id')
         return(folder_id)
     
+    def get_parent_id(self, file_id : str):
+        return(self.client.file(file_id).get(fields = ['parent']).parent['id'])
+    
+    def get_file_id(self, folder_id : str, file_name : str):
+        matches = [f.get('id') for f in self.get_file_list(folder_id) if f.get('name') == file_name]
+        return(matches[0] if matches else None)
+    
     def get_file_list(self, folder_id : str):
         items = self.client.folder(folder_id = folder_id).get_items()
         files = [{'type' : item.type, 'id' : item.id, 'name' : item.name} for item in items]
@@ -62,23 +75,134 @@ class ProbitasBox():
             output = io.BytesIO(file_content)
         return(output)
     
+    def get_file_stream(self, file_id : str, chunk_size : int = 1024 * 1024):
+        # File-like view of the download, read chunk by chunk as it arrives rather than into memory whole,
+        # e.g. for pd.read_csv or PostgreSQL.copy_file (as File.download_to, without a file to write to)
+        url = self.client.file(file_id).get_url('content')
+        response = self.client.session.get(url, expect_json_response = False, stream = True)
+        
+        def chunks():
+            raw = response.network_response.response_as_stream()
+            try:
+                for chunk in raw.stream(chunk_size, decode_content = True):
+                    yield chunk
+            finally:
+                raw.release_conn()
+        
+        return(io.BufferedReader(ChunkedStream(chunks()), buffer_size = chunk_size))
+    
     def delete_file(self, file_id : str):
         self.client.file(file_id = file_id).delete()
         
-    def update_file(self, file_id : str, df, sep = ',', index = False, header = True):
-        stream = io.StringIO()
-        df.to_csv(stream, sep = sep, index = False, header = header)
+    def write_csv(self, df, f, sep = ',', header = True, compress = False, chunk_rows = 100000):
+        # Renders df into the binary file f chunk_rows rows at a time, optionally gzip-compressed,
+        # so only one chunk of text is in memory at once. Returns the number of bytes written
+        out = gzip.GzipFile(fileobj = f, mode = 'wb') if compress else f
+        for start in range(0, max(len(df), 1), chunk_rows):
+            chunk = df.iloc[start:start + chunk_rows]
+            out.write(chunk.to_csv(sep = sep, index = False, header = header and start == 0).encode('utf-8'))
+        if compress:
+            out.close()
+        size = f.tell()
+        f.seek(0)
+        return(size)
+    
+    def upload_parts(self, session, f, size : int, workers = 4):
+        # Uploads f in the session's part size, several parts at once, then commits the parts with the file's SHA-1
+        digest = hashlib.sha1()
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+        
+        lock = threading.Lock()
+        def upload_part(offset):
+            with lock:
+                f.seek(offset)
+                part = f.read(session.part_size)
+            return(session.upload_part_bytes(part, offset, size))
         
-        upload = self.client.file(file_id).update_contents_with_stream(stream)
+        try:
+            with ThreadPoolExecutor(workers) as executor:
+                parts = list(executor.map(upload_part, range(0, size, session.part_size)))
+            return(session.commit(content_sha1 = digest.digest(), parts = parts))
+        except:
+            session.abort()
+            raise
+    
+    def stream_upload(self, df, file_id : str = None, folder_id : str = None, file_name : str = None, sep = ',', header = True, compress = False, chunk_rows = 100000, workers = 4):
+        # Uploads df as CSV to a new file in folder_id, or as a new version of file_id, without the whole CSV in memory:
+        # rendered in chunks to a temporary file, then sent in concurrent parts through a chunked upload session
+        # (or in one request, below Box's minimum size for sessions)
+        with tempfile.TemporaryFile() as f:
+            size = self.write_csv(df, f, sep, header, compress, chunk_rows)
+            upload = self.send_file(f, size, file_id, folder_id, file_name, workers)
+        print(f"Uploaded {size / 1e6:,.1f} MB{' (gzip)' if compress else ''}{' in chunks' if size >= self.chunked_upload_min else ''}")
+        return(upload)
+    
+    def send_file(self, f, size : int, file_id : str = None, folder_id : str = None, file_name : str = None, workers = 4):
+        # Uploads the binary file f to a new file in folder_id, or as a new version of file_id
+        if size >= self.chunked_upload_min:
+            if file_id:
+                session = self.client.file(file_id).create_upload_session(size)
+            else:
+                session = self.client.folder(folder_id).create_upload_session(size, file_name)
+            return(self.upload_parts(session, f, size, workers))
+        elif file_id:
+            return(self.client.file(file_id).update_contents_with_stream(f))
+        else:
+            return(self.client.folder(folder_id).upload_stream(f, file_name))
+    
+    def put_parquet(self, folder_id : str, df, file_name : str, compression = 'zstd'):
+        # Typed, compressed columnar artifact for handing data between flow stages (CSV & TSV are kept for exports).
+        # Replaces any file of the same name in the folder with a new version, and returns the file ID
+        file_id = self.get_file_id(folder_id, file_name)
+        with tempfile.TemporaryFile() as f:
+            df.to_parquet(f, compression = compression, index = False)
+            size = f.tell()
+            f.seek(0)
+            upload = self.send_file(f, size, file_id = file_id, folder_id = folder_id, file_name = file_name)
+        
+        if file_id:
+            self.updated_files.update({upload.name : upload.id})
+        else:
+            self.uploaded_files.update({upload.name : upload.id})
+        print(f"File {upload.name} uploaded to Box with file ID {upload.id} | {size / 1e6:,.1f} MB ({compression})")
+        return(upload.id)
+    
+    def get_parquet(self, file_id : str, columns : list = None):
+        # Reads a Parquet artifact back with its dtypes. With columns, only those columns are decoded
+        with tempfile.TemporaryFile() as f:
+            shutil.copyfileobj(self.get_file_stream(file_id), f, 1024 * 1024)
+            f.seek(0)
+            return(pd.read_parquet(f, columns = columns))
+
+    def get_artifact(self, folder_id : str, file_name : str, columns : list = None):
+        # Reads a Parquet artifact by name (see put_parquet), failing clearly when no earlier stage has written it
+        file_id = self.get_file_id(folder_id, file_name)
+        if file_id is None:
+            raise FileNotFoundError(f"{file_name} not found in Box folder {folder_id} - run the stage which writes it first")
+        return(self.get_parquet(file_id, columns = columns))
+
+    def update_file(self, file_id : str, df, sep = ',', index = False, header = True, streaming = False, compress = False):
+        if streaming or compress:
+            upload = self.stream_upload(df, file_id = file_id, sep = sep, header = header, compress = compress)
+        else:
+            stream = io.StringIO()
+            df.to_csv(stream, sep = sep, index = False, header = header)
+            upload = self.client.file(file_id).update_contents_with_stream(stream)
         self.updated_files.update({upload.name : upload.id})
         
         print('File "{0}" uploaded to Box with file ID {1}'.format(upload.name, upload.id))
     
-    def upload_file(self, folder_id : str, df, file_name : str, sep = ',', index = False, header = True, conflict_override = False):
+    def upload_file(self, folder_id : str, df, file_name : str, sep = ',', index = False, header = True, conflict_override = False, streaming = False, compress = False):
         try:
-            stream = io.StringIO()
-            df.to_csv(stream, sep = sep, index = False, header = header)
-            upload = self.client.folder(folder_id).upload_stream(stream, file_name)
+            if compress and not file_name.endswith('.gz'):
+                file_name = file_name + '.gz'
+            if streaming or compress:
+                upload = self.stream_upload(df, folder_id = folder_id, file_name = file_name, sep = sep, header = header, compress = compress)
+            else:
+                stream = io.StringIO()
+                df.to_csv(stream, sep = sep, index = False, header = header)
+                upload = self.client.folder(folder_id).upload_stream(stream, file_name)
             self.uploaded_files.update({upload.name : upload.id})
             print(f"File {upload.name} uploaded to Box with file ID {upload.id}")
         except exception.BoxAPIException as e:
@@ -87,7 +211,7 @@ class ProbitasBox():
                 if conflict_override:
                     existing_file = error.get('Context Info').get('conflicts').get('id')
                     print(f"Warning -- conflict overridden. Updating file: {existing_file}")
-                    self.update_file(existing_file, df, sep, index, header)
+                    self.update_file(existing_file, df, sep, index, header, streaming, compress)
                 else:
                     print("Conflict with existing file.")
                     pprint(error)
@@ -52,6 +52,39 @@ class Geographies():
         # add the handlers to logger
         self.logger.addHandler(self.fh)
 
+    def split_multi_state_areas(self, df, name_col: str = 'name_area', fips_col: str = 'fips_state', state_name_col: str = 'name_state',
+                                flag_col: str = 'flags', flag: str = 'Multi-State Metro Area'):
+        '''
+        Metro areas spanning several states are named with their states after the comma, e.g. "Allentown-Bethlehem-Easton, PA-NJ".
+        Rows of such areas keep their principal (first listed) state, and are copied once for each additional state with
+        fips_col & state_name_col set to that state. All rows of multi-state areas, copies included, are flagged in
+        flag_col: the flag is appended to any existing flags (comma separated), and flag_col is created if missing.
+
+        The state list is parsed once per distinct area name, exploded, and joined to self.states in a single merge.
+        Requires Geographies(with_vars = True).
+
+        >>> geo.split_multi_state_areas(msa_employment)
+        '''
+        names = pd.Series(df[name_col].unique())
+        lookup = pd.DataFrame({
+            name_col : names,
+            'abbreviation_state' : names.str.split(',', n = 1).str[1].str.strip().str.split('-')
+            }).explode('abbreviation_state')
+        lookup['state_order'] = lookup.groupby(name_col).cumcount()
+
+        additional = lookup.loc[lookup['state_order'] > 0]
+        additional = additional.merge(self.states, on = 'abbreviation_state', how = 'inner')
+        additional = additional[[name_col, 'fips_state', 'name_state']].rename(columns = {'fips_state' : fips_col, 'name_state' : state_name_col})
+
+        df = df.copy()
+        if flag_col not in df:
+            df[flag_col] = ''
+        multi = df[name_col].isin(additional[name_col])
+        flags = df.loc[multi, flag_col].fillna('').astype('str')
+        df.loc[multi, flag_col] = flags.where(flags == '', flags + ',') + flag
+        copies = df.drop(columns = [fips_col, state_name_col]).merge(additional, on = name_col, how = 'inner')
+        return(pd.concat([df, copies[df.columns]], ignore_index = True))
+
     def standardize_address(self, address: str):
         standardization = {
             r'(?P<before>\S)&(?P<after>\S)' : r'\g<before> & \g<after>', # Non whitespace char, followed by & and another non space char
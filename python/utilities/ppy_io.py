@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""File-like objects shared by the Box & SQL utilities, kept free of either's dependencies
+"""
+
+# -- Imports --------------------------------------------------------------------------------
+import io
+
+# -- Streams --------------------------------------------------------------------------------
+
+class ChunkedStream(io.RawIOBase):
+    """Read-only file-like object over an iterator of byte chunks, so psycopg2's copy_expert (or anything
+       else reading files) can consume data as it is produced, holding only one chunk in memory.
+
+       Example:
+           >>> stream = ppy_io.ChunkedStream(chunk.encode() for chunk in chunks)
+           >>> db.cursor.copy_expert('COPY table_name FROM STDIN', stream)
+    """
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        # A view of the current chunk, so small reads do not copy the rest of it
+        self.buffer = memoryview(b'')
+
+    def readable(self) -> bool:
+        return(True)
+
+    def readinto(self, b) -> int:
+        while not self.buffer:
+            try:
+                self.buffer = memoryview(next(self.chunks))
+            except StopIteration:
+                return(0)
+        n = min(len(b), len(self.buffer))
+        b[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return(n)
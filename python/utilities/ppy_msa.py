@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Source for the BLS metropolitan area LAUS workbook (ssamatab1), with a local columnar cache
+"""
+
+# -- Imports --------------------------------------------------------------------------------
+import os, glob, json, hashlib, zipfile
+
+import pandas as pd
+import pyarrow.feather as feather
+
+from probitaspy.ppy_web import create_session
+
+# -- MSA ------------------------------------------------------------------------------------
+
+class MSAEmployment():
+    """Downloads ssamatab1.zip only when it has changed, and parses the workbook once.
+       The parsed sheet is cached as an uncompressed Arrow (Feather) file named by the zip's SHA-256,
+       which later reads memory-map instead of re-parsing Excel.
+           cache_dir -- where the zip, its HTTP validators & the Arrow file are kept
+
+       Example:
+           >>> msa = ppy_msa.MSAEmployment()
+           >>> msa.read()             # conditional download, then cached read
+           >>> msa.read(refresh = False) # cached read only, e.g. for transform-only runs
+    """
+    url = 'https://www.bls.gov/web/metro/ssamatab1.zip'
+    file_name = 'ssamatab1.xlsx'
+
+    integer_columns = ['State FIPS Code', 'Area FIPS Code', 'Year', 'Month']
+    value_columns = ['Civilian Labor Force', 'Employment', 'Unemployment', 'Unemployment Rate']
+
+    def __init__(self, cache_dir: str = '', chunk_size: int = 1024 * 1024):
+        self.cache_dir = cache_dir or os.path.join(os.getcwd(), 'bls_msa_cache')
+        os.makedirs(self.cache_dir, exist_ok = True)
+
+        self.zip_path = os.path.join(self.cache_dir, 'ssamatab1.zip')
+        self.meta_path = os.path.join(self.cache_dir, 'ssamatab1.json')
+        self.chunk_size = chunk_size
+        self.r = create_session(timeout = 30)
+
+    def load_meta(self) -> dict:
+        if not os.path.exists(self.meta_path) or not os.path.exists(self.zip_path):
+            return({})
+        with open(self.meta_path) as f:
+            return(json.load(f))
+
+    def download(self) -> bool:
+        """Conditional GET using the stored ETag / Last-Modified. The zip is streamed to disk and hashed
+           in chunks, so it is never held in memory. Returns True if a new file was downloaded.
+        """
+        meta = self.load_meta()
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+        with self.r.get(self.url, headers = headers, stream = True) as response:
+            if response.status_code == 304:
+                print(f"Not modified: {self.url}")
+                return(False)
+
+            digest = hashlib.sha256()
+            partial = self.zip_path + '.part'
+            with open(partial, 'wb') as f:
+                for chunk in response.iter_content(chunk_size = self.chunk_size):
+                    digest.update(chunk)
+                    f.write(chunk)
+            os.replace(partial, self.zip_path)
+
+            meta = {
+                'etag' : response.headers.get('ETag'),
+                'last_modified' : response.headers.get('Last-Modified'),
+                'sha256' : digest.hexdigest()
+            }
+        with open(self.meta_path, 'w') as f:
+            json.dump(meta, f)
+        print(f"Downloaded: {self.url} | sha256 {meta['sha256'][:16]}")
+        return(True)
+
+    def arrow_path(self, sha256: str) -> str:
+        return(os.path.join(self.cache_dir, f'ssamatab1_{sha256[:16]}.arrow'))
+
+    def parse_workbook(self) -> pd.DataFrame:
+        """Parse the sheet from the zip on disk into typed columns (the slow step, run once per file)
+        """
+        with zipfile.ZipFile(self.zip_path) as z, z.open(self.file_name) as f:
+            frame = pd.read_excel(f, skiprows = 2)
+
+        # Skip blank row between header & data
+        frame = frame.iloc[1:,]
+        # Remove empty rows & descriptive text at the end of the file
+        frame = frame.loc[~((pd.isnull(frame['LAUS Code'])) | (pd.isnull(frame['Area'])))]
+
+        for col in self.integer_columns:
+            frame[col] = pd.to_numeric(frame[col]).astype('int32')
+        # '-' marks missing values
+        for col in self.value_columns:
+            frame[col] = pd.to_numeric(frame[col], errors = 'coerce')
+        for col in frame.select_dtypes('object').columns:
+            frame[col] = frame[col].astype('str')
+        return(frame.reset_index(drop = True))
+
+    def read(self, refresh: bool = True) -> pd.DataFrame:
+        """Return the parsed sheet. With refresh, first checks BLS for a newer file.
+           The Arrow file is memory-mapped, so repeated reads skip Excel parsing entirely.
+        """
+        if refresh or not self.load_meta():
+            self.download()
+        meta = self.load_meta()
+
+        path = self.arrow_path(meta['sha256'])
+        if not os.path.exists(path):
+            frame = self.parse_workbook()
+            feather.write_feather(frame, path, compression = 'uncompressed')
+            # Only the current file's cache is kept
+            for old in glob.glob(os.path.join(self.cache_dir, 'ssamatab1_*.arrow')):
+                if old != path:
+                    os.remove(old)
+        return(feather.read_table(path, memory_map = True).to_pandas())
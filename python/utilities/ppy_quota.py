@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""Persistent API quota accounting, API key pools, and a queue for requests deferred to the next quota window
+"""
+
+# -- Imports --------------------------------------------------------------------------------
+import os, json, time, sqlite3, hashlib, asyncio, threading
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from probitaspy.web import TokenBucket
+
+def default_path() -> str:
+    """quota.sqlite in the user's cache directory ($XDG_CACHE_HOME or ~/.cache, under probitaspy), so the ledger
+       is shared by every flow & run of the user, wherever it is started from
+    """
+    cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'probitaspy')
+    os.makedirs(cache_dir, exist_ok = True)
+    return(os.path.join(cache_dir, 'quota.sqlite'))
+
+class QuotaExceeded(Exception):
+    """Raised when an API key has no requests left in the current quota window.
+           api -- the API the quota belongs to (e.g. 'bls')
+           key_id -- a short hash identifying the key (keys themselves are never stored or shown)
+           limit -- requests allowed per window
+           resets_at -- when the next window starts
+    """
+    def __init__(self, api: str, key_id: str, limit: int, resets_at: datetime, message: str = ''):
+        self.api = api
+        self.key_id = key_id
+        self.limit = limit
+        self.resets_at = resets_at
+        super().__init__(message or f'{api} quota of {limit} requests reached for key {key_id}, resets at {resets_at.isoformat()}')
+
+# -- Ledger ---------------------------------------------------------------------------------
+
+class QuotaLedger():
+    """Counts the requests made per API key per day in a local SQLite database, so the count
+       survives restarts & is shared by every flow using the same file.
+           api -- namespace for the keys (e.g. 'bls')
+           limit -- requests allowed per key per day
+           path -- location of the SQLite file (defaults to quota.sqlite in the user's cache directory, see default_path)
+           timezone -- the day boundary of the quota window
+
+       Example:
+           >>> ledger = ppy_quota.QuotaLedger('bls', limit = 500)
+           >>> ledger.reserve(api_key)  # raises QuotaExceeded once 500 requests have been made today
+           >>> ledger.remaining(api_key)
+           499
+    """
+
+    def __init__(self, api: str, limit: int, path: str = '', timezone: str = 'America/New_York'):
+        self.api = api
+        self.limit = limit
+        self.path = path or default_path()
+        self.timezone = ZoneInfo(timezone)
+
+        # Shared by request threads, so access is serialised
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread = False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS quota(
+                api TEXT,
+                key_id TEXT,
+                day TEXT,
+                requests INTEGER,
+                PRIMARY KEY (api, key_id, day)
+            )
+            """)
+        self.connection.commit()
+
+    def key_id(self, api_key: str) -> str:
+        return(hashlib.sha256(str(api_key).encode()).hexdigest()[:12])
+
+    def window(self) -> str:
+        """The current quota window, as the date (YYYY-MM-DD) in self.timezone
+        """
+        return(datetime.now(self.timezone).strftime('%Y-%m-%d'))
+
+    def resets_at(self) -> datetime:
+        """Start of the next quota window
+        """
+        today = datetime.now(self.timezone).replace(hour = 0, minute = 0, second = 0, microsecond = 0)
+        return(today + timedelta(days = 1))
+
+    def used(self, api_key: str) -> int:
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT requests FROM quota WHERE api = ? AND key_id = ? AND day = ?',
+                (self.api, self.key_id(api_key), self.window())).fetchone()
+        return(row[0] if row else 0)
+
+    def remaining(self, api_key: str) -> int:
+        return(max(self.limit - self.used(api_key), 0))
+
+    def reserve(self, api_key: str, n: int = 1) -> None:
+        """Count n requests against the key before they are sent, raising QuotaExceeded if that would exceed the limit.
+           Reserving first keeps concurrent requests from overshooting the quota.
+        """
+        key_id, window = self.key_id(api_key), self.window()
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT requests FROM quota WHERE api = ? AND key_id = ? AND day = ?',
+                (self.api, key_id, window)).fetchone()
+            used = row[0] if row else 0
+            if used + n > self.limit:
+                raise QuotaExceeded(self.api, key_id, self.limit, self.resets_at())
+            self.connection.execute(
+                'INSERT OR REPLACE INTO quota (api, key_id, day, requests) VALUES (?, ?, ?, ?)',
+                (self.api, key_id, window, used + n))
+            self.connection.commit()
+
+    def release(self, api_key: str, n: int = 1) -> None:
+        """Return n reserved requests which did not reach the API (e.g. served from a cache)
+        """
+        with self.lock:
+            self.connection.execute(
+                'UPDATE quota SET requests = MAX(requests - ?, 0) WHERE api = ? AND key_id = ? AND day = ?',
+                (n, self.api, self.key_id(api_key), self.window()))
+            self.connection.commit()
+
+    def exhaust(self, api_key: str) -> None:
+        """Mark the key as used up for the current window, e.g. when the API reports its quota reached
+           before the ledger does (requests made elsewhere with the same key)
+        """
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO quota (api, key_id, day, requests) VALUES (?, ?, ?, ?)',
+                (self.api, self.key_id(api_key), self.window(), self.limit))
+            self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
+
+# -- Key Pool -------------------------------------------------------------------------------
+
+class KeyPool():
+    """Spreads requests over several API keys, each with its own rate limit (web.TokenBucket) and, optionally,
+       its own daily quota (QuotaLedger). Keys are taken in turn; a key without a free token, with no quota left,
+       or throttled by the API is skipped, so throughput grows with the number of keys.
+           api -- namespace for the quota ledger (e.g. 'bls')
+           keys -- list of API keys, e.g. from ppy_auth.Auth.get_keys
+           rate_limit / rate_period -- requests allowed per key per period (seconds), None for no rate limit
+           daily_limit -- requests allowed per key per day, None for no quota
+           path -- location of the quota SQLite file
+
+       Example:
+           >>> pool = ppy_quota.KeyPool('fred', auth.get_keys('dev/api/fred'), rate_limit = 120)
+           >>> key = pool.acquire()           # blocks until some key has a free token
+           >>> pool.throttle(key, 60)         # e.g. on HTTP 429, skip the key for a minute
+    """
+
+    def __init__(self, api: str, keys: list, rate_limit: float = None, rate_period: float = 60, daily_limit: int = None, path: str = ''):
+        self.api = api
+        self.keys = list(dict.fromkeys(keys))
+        if not self.keys:
+            raise ValueError(f'No API keys provided for {api}')
+
+        self.buckets = {k : TokenBucket(rate = rate_limit, period = rate_period) for k in self.keys} if rate_limit else {}
+        self.ledger = QuotaLedger(api, limit = daily_limit, path = path) if daily_limit else None
+        self.throttled = {}
+        self.next = 0
+        self.lock = threading.Lock()
+
+    def key_id(self, api_key: str) -> str:
+        return(hashlib.sha256(str(api_key).encode()).hexdigest()[:12])
+
+    def remaining(self) -> int:
+        """Requests left today across all keys (None without a daily quota)
+        """
+        if self.ledger is None:
+            return(None)
+        return(sum(self.ledger.remaining(k) for k in self.keys))
+
+    def try_acquire(self) -> tuple:
+        """Returns (key, 0) for the next usable key, or (None, seconds until one may be).
+           Raises QuotaExceeded once every key has used its daily quota.
+        """
+        now = time.monotonic()
+        waits = []
+        exhausted = 0
+        with self.lock:
+            for i in range(len(self.keys)):
+                index = (self.next + i) % len(self.keys)
+                key = self.keys[index]
+                if self.throttled.get(key, 0) > now:
+                    waits.append(self.throttled[key] - now)
+                    continue
+                if self.ledger is not None and self.ledger.remaining(key) <= 0:
+                    exhausted += 1
+                    continue
+                # The token is only taken once the quota is reserved, so a refused key keeps it
+                wait = self.buckets[key].wait_time() if key in self.buckets else 0
+                if wait > 0:
+                    waits.append(wait)
+                    continue
+                if self.ledger is not None:
+                    try:
+                        self.ledger.reserve(key)
+                    except QuotaExceeded:
+                        exhausted += 1
+                        continue
+                if key in self.buckets:
+                    self.buckets[key].take()
+                self.next = index + 1
+                return(key, 0)
+        if exhausted == len(self.keys):
+            raise QuotaExceeded(self.api, f'all {len(self.keys)} keys', self.ledger.limit, self.ledger.resets_at())
+        return(None, min(waits))
+
+    def acquire(self) -> str:
+        """Blocks until a key is usable, and returns it (counted against its rate limit & quota)
+        """
+        key, wait = self.try_acquire()
+        while key is None:
+            time.sleep(wait)
+            key, wait = self.try_acquire()
+        return(key)
+
+    async def acquire_async(self) -> str:
+        """As acquire, awaiting rather than blocking
+        """
+        key, wait = self.try_acquire()
+        while key is None:
+            await asyncio.sleep(wait)
+            key, wait = self.try_acquire()
+        return(key)
+
+    def release(self, api_key: str) -> None:
+        """Return a request which did not reach the API (e.g. served from a cache) to the key's quota
+        """
+        if self.ledger is not None:
+            self.ledger.release(api_key)
+
+    def throttle(self, api_key: str, seconds: float = 60) -> None:
+        """Skip the key for the given number of seconds, e.g. after the API rate-limited it
+        """
+        with self.lock:
+            self.throttled[api_key] = time.monotonic() + seconds
+        print(f'{self.api} key {self.key_id(api_key)} throttled for {seconds}s')
+
+    def exhaust(self, api_key: str) -> None:
+        """Skip the key until its quota resets, e.g. when the API reports it used up
+        """
+        if self.ledger is not None:
+            self.ledger.exhaust(api_key)
+        else:
+            self.throttle(api_key, 24 * 60 * 60)
+
+# -- Deferred Requests ----------------------------------------------------------------------
+
+class RequestQueue():
+    """Persists planned requests which could not be made within the current quota window, so the next run
+       picks them up again. Requests are JSON-serialisable dicts, identified by a hash of their content,
+       so re-queueing the same request is a no-op.
+           api -- namespace for the requests (e.g. 'bls')
+           path -- location of the SQLite file (defaults to quota.sqlite in the user's cache directory, see default_path)
+
+       Example:
+           >>> queue = ppy_quota.RequestQueue('bls')
+           >>> queue.add('laus', plan)
+           >>> for request in queue.pending('laus'):
+           ...     make_request(request)
+           ...     queue.done('laus', request)
+    """
+
+    def __init__(self, api: str, path: str = ''):
+        self.api = api
+        self.path = path or default_path()
+
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread = False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS deferred_requests(
+                api TEXT,
+                job TEXT,
+                request_id TEXT,
+                request TEXT,
+                queued_on TEXT,
+                PRIMARY KEY (api, job, request_id)
+            )
+            """)
+        self.connection.commit()
+
+    def request_id(self, request: dict) -> str:
+        return(hashlib.sha256(json.dumps(request, sort_keys = True).encode()).hexdigest())
+
+    def add(self, job: str, requests: list) -> None:
+        queued_on = datetime.now().isoformat()
+        rows = [(self.api, job, self.request_id(r), json.dumps(r, sort_keys = True), queued_on) for r in requests]
+        with self.lock:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO deferred_requests (api, job, request_id, request, queued_on) VALUES (?, ?, ?, ?, ?)',
+                rows)
+            self.connection.commit()
+
+    def pending(self, job: str) -> list:
+        """Return the job's outstanding requests, oldest first
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT request FROM deferred_requests WHERE api = ? AND job = ? ORDER BY queued_on, rowid',
+                (self.api, job)).fetchall()
+        return([json.loads(r[0]) for r in rows])
+
+    def done(self, job: str, request: dict) -> None:
+        with self.lock:
+            self.connection.execute(
+                'DELETE FROM deferred_requests WHERE api = ? AND job = ? AND request_id = ?',
+                (self.api, job, self.request_id(request)))
+            self.connection.commit()
+
+    def clear(self, job: str = None) -> None:
+        with self.lock:
+            if job is None:
+                self.connection.execute('DELETE FROM deferred_requests WHERE api = ?', (self.api,))
+            else:
+                self.connection.execute('DELETE FROM deferred_requests WHERE api = ? AND job = ?', (self.api, job))
+            self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
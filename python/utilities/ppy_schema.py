@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""Definitions of the tables the flows load: columns, date range partitions, natural keys & indexes
+"""
+
+# -- Imports --------------------------------------------------------------------------------
+from datetime import datetime
+
+# -- Table ----------------------------------------------------------------------------------
+
+class Table():
+    """A table definition, created through a ppy_sql.PostgreSQL connection.
+       With partition_column, the table is range-partitioned into one partition per partition_years
+       from partition_start until a decade past the current year, plus a default partition for any other dates.
+       Partitions are named {table}_p{start year}, e.g. dems_fred_p1990.
+           name -- table name
+           columns -- list of (column, type)
+           natural_key -- columns or expressions identifying a row, as used by PostgreSQL.upsert_dataframe.
+                          Created as the unique index {table}_natural_key; on a partitioned table it must include
+                          partition_column as a plain column
+           indexes -- further indexes as {suffix : [columns]}, created as {table}_{suffix}
+           partition_column / partition_start / partition_years -- date range partitioning, None for a plain table
+
+       Example:
+           >>> ppy_schema.dems_fred.create(db)                       # table, partitions & indexes, if missing
+           >>> ppy_schema.dems_fred.create(db, 'dems_fred_new', indexes = False)
+           >>> db.copy_dataframe(master, 'dems_fred_new')
+           >>> ppy_schema.dems_fred.create_indexes(db, 'dems_fred_new')  # built after the bulk load, then ANALYZE
+    """
+
+    def __init__(self, name: str, columns: list, natural_key: list = None, indexes: dict = None, partition_column: str = None, partition_start: int = 1950, partition_years: int = 10):
+        self.name = name
+        self.columns = columns
+        self.natural_key = natural_key or []
+        self.indexes = indexes or {}
+        self.partition_column = partition_column
+        self.partition_start = partition_start
+        self.partition_years = partition_years
+
+    def partitions(self) -> list:
+        """Returns (year, start date, end date) per range partition
+        """
+        if not self.partition_column:
+            return([])
+        end = datetime.now().year + 10
+        return([(y, f'{y}-01-01', f'{y + self.partition_years}-01-01') for y in range(self.partition_start, end, self.partition_years)])
+
+    def create_sql(self, name: str = None) -> str:
+        """SQL to create the table & its partitions if they do not exist, without indexes
+        """
+        name = name or self.name
+        columns = ',\n    '.join(f'{c} {t}' for c,t in self.columns)
+        sql = f'CREATE TABLE IF NOT EXISTS {name}(\n    {columns}\n)'
+        if not self.partition_column:
+            return(sql + ';')
+
+        sql += f' PARTITION BY RANGE ({self.partition_column});\n'
+        for year, start, end in self.partitions():
+            sql += f"CREATE TABLE IF NOT EXISTS {name}_p{year} PARTITION OF {name} FOR VALUES FROM ('{start}') TO ('{end}');\n"
+        sql += f'CREATE TABLE IF NOT EXISTS {name}_default PARTITION OF {name} DEFAULT;'
+        return(sql)
+
+    def index_sql(self, name: str = None, natural_key: bool = True) -> list:
+        """SQL to create the natural key (unless natural_key is False) & other indexes if they do not exist.
+           Indexes created on a partitioned table are created on each of its partitions
+        """
+        name = name or self.name
+        key_list = lambda keys: ', '.join(k if k.isidentifier() else f'({k})' for k in keys)
+        sql = []
+        if self.natural_key and natural_key:
+            sql.append(f'CREATE UNIQUE INDEX IF NOT EXISTS {name}_natural_key ON {name} ({key_list(self.natural_key)})')
+        for suffix, columns in self.indexes.items():
+            sql.append(f'CREATE INDEX IF NOT EXISTS {name}_{suffix} ON {name} ({key_list(columns)})')
+        return(sql)
+
+    def create(self, db, name: str = None, indexes: bool = True) -> None:
+        """Creates the table & its partitions, and unless indexes is False (e.g. ahead of a bulk load), its indexes.
+           A table created before it was partitioned is left as it is, until a full load replaces it
+        """
+        name = name or self.name
+        kind = db.execute_fetchall('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', (name,))
+        if self.partition_column and kind and kind[0][0] != 'p':
+            print(f"{name} is not partitioned, a full load migrates it (see PostgreSQL.swap_dataframe)")
+        else:
+            db.execute_commit(self.create_sql(name))
+        if indexes:
+            self.create_indexes(db, name)
+
+    def create_indexes(self, db, name: str = None) -> None:
+        """Builds the indexes in bulk, e.g. after COPY rather than maintaining them during it, and refreshes the statistics
+        """
+        name = name or self.name
+        # An existing table may hold duplicate keys, which create_unique_index removes first
+        if self.natural_key:
+            db.create_unique_index(name, self.natural_key)
+        for sql in self.index_sql(name, natural_key = False):
+            db.execute_commit(sql)
+        db.execute_commit(f'ANALYZE {name}')
+
+# -- Tables ---------------------------------------------------------------------------------
+
+# Values are DOUBLE PRECISION, which COPY can stream in binary format (see PostgreSQL.copy_dataframe)
+dems_fred = Table(
+    'dems_fred',
+    columns = [
+        ('fred_date', 'DATE'),
+        ('geo_scope', 'TEXT'),
+        ('geo_abbreviation', 'TEXT'),
+        ('variable', 'TEXT'),
+        ('variable_name', 'TEXT'),
+        ('variable_adjustment', 'TEXT'),
+        ('value', 'DOUBLE PRECISION'),
+        ('data_loaded_on', 'TIMESTAMP'),
+        ('data_loaded_by', 'TEXT')
+    ],
+    natural_key = ['geo_scope', 'geo_abbreviation', 'variable', 'fred_date'],
+    partition_column = 'fred_date',
+    partition_start = 1940
+)
+
+# Revision history, see PostgreSQL.merge_vintage & PostgreSQL.as_of
+dems_fred_vintages = Table(
+    'dems_fred_vintages',
+    columns = [
+        ('fred_date', 'DATE'),
+        ('geo_scope', 'TEXT'),
+        ('geo_abbreviation', 'TEXT'),
+        ('variable', 'TEXT'),
+        ('value', 'DOUBLE PRECISION'),
+        ('realtime_start', 'DATE'),
+        ('realtime_end', "DATE DEFAULT '9999-12-31'")
+    ],
+    indexes = {'as_of' : ['variable', 'geo_abbreviation', 'fred_date', 'realtime_start']}
+)
+
+# fips_area is NULL for national & state rows, hence COALESCE in the natural key (a unique index treats NULLs as distinct)
+dems_bls_laus = Table(
+    'dems_bls_laus',
+    columns = [
+        ('fips_state', 'INT'),
+        ('fips_area', 'INT'),
+        ('name_state', 'TEXT'),
+        ('name_area', 'TEXT'),
+        ('type_area', 'TEXT'),
+        ('geo_scope', 'TEXT'),
+        ('laus_series_name', 'TEXT'),
+        ('laus_year', 'INT'),
+        ('laus_month', 'INT'),
+        ('laus_date', 'DATE'),
+        ('laus_value', 'DOUBLE PRECISION'),
+        ('flags', 'TEXT'),
+        ('data_loaded_on', 'TIMESTAMP'),
+        ('data_loaded_by', 'TEXT')
+    ],
+    natural_key = ['geo_scope', 'fips_state', 'COALESCE(fips_area, 0)', 'laus_series_name', 'laus_date'],
+    partition_column = 'laus_date',
+    partition_start = 1970
+)
+
+tables = {t.name : t for t in [dems_fred, dems_fred_vintages, dems_bls_laus]}
@@ -3,10 +3,291 @@
 """
 
 # -- Imports --------------------------------------------------------------------------------
-import json, pprint, sys
+import os, re, json, pprint, sys, time, uuid, queue, asyncio, weakref, threading
 from datetime import datetime
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
 import psycopg2
+import psycopg2.pool
+import psycopg2.extensions
+
+from probitaspy.ppy_io import ChunkedStream
+
+# -- Result Types ---------------------------------------------------------------------------
+
+# Arrow types for PostgreSQL type OIDs (pg_type.oid); other types are inferred from the values (read as text from CSV)
+ARROW_TYPES = {
+    16 : pa.bool_(), 20 : pa.int64(), 21 : pa.int16(), 23 : pa.int32(),
+    700 : pa.float32(), 701 : pa.float64(), 1700 : pa.float64(),
+    25 : pa.string(), 1042 : pa.string(), 1043 : pa.string(), 19 : pa.string(),
+    1082 : pa.date32(), 1114 : pa.timestamp('us'), 1184 : pa.timestamp('us', tz = 'UTC')
+}
+# Nullable pandas dtypes, so integer & boolean columns with NULLs keep their type
+PANDAS_TYPES = {pa.int16() : pd.Int16Dtype(), pa.int32() : pd.Int32Dtype(), pa.int64() : pd.Int64Dtype(), pa.bool_() : pd.BooleanDtype()}
+# NUMERIC is read as float rather than Decimal, for vectorized columns
+NUMERIC_FLOAT = psycopg2.extensions.new_type((1700,), 'NUMERIC_FLOAT', lambda value, cursor: float(value) if value is not None else None)
+
+def rows_to_arrow(rows: list, description) -> pa.RecordBatch:
+    """Converts fetched rows into an Arrow record batch, typed from the cursor description's type OIDs"""
+    columns = list(zip(*rows)) if rows else [[] for _ in description]
+    arrays = []
+    for values, column in zip(columns, description):
+        arrow_type = ARROW_TYPES.get(column.type_code)
+        try:
+            arrays.append(pa.array(values, type = arrow_type))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            arrays.append(pa.array([None if v is None else str(v) for v in values], type = pa.string()))
+    return(pa.RecordBatch.from_arrays(arrays, names = [c.name for c in description]))
+
+def csv_to_arrow(source, description) -> pa_csv.CSVStreamingReader:
+    """Opens COPY ... TO STDOUT (FORMAT csv) output as a stream of Arrow record batches, parsed by pyarrow in C++
+       as it is read. COPY writes NULL as an unquoted empty field & empty strings quoted, so the two stay distinct.
+       Types without an Arrow type are read as text, as a stream cannot infer them from the first block alone.
+    """
+    names = [c.name for c in description]
+    types = {c.name : ARROW_TYPES.get(c.type_code, pa.string()) for c in description}
+    return(pa_csv.open_csv(
+        source,
+        read_options = pa_csv.ReadOptions(column_names = names),
+        parse_options = pa_csv.ParseOptions(newlines_in_values = True),
+        convert_options = pa_csv.ConvertOptions(
+            column_types = types, null_values = [''], strings_can_be_null = True, quoted_strings_can_be_null = False,
+            true_values = ['t'], false_values = ['f'])))
+
+def arrow_to_pandas(data) -> pd.DataFrame:
+    """Converts an Arrow table or record batch to a DataFrame with datetime64 dates & nullable integers"""
+    return(data.to_pandas(date_as_object = False, types_mapper = PANDAS_TYPES.get))
+
+# -- Connection Pools -----------------------------------------------------------------------
+
+class ConnectionPool():
+    """Thread-safe pool of warm psycopg2 connections. Use connection_pool() to share one pool per database
+       between every PostgreSQL object (and so every task or flow) in the process.
+           dsn -- psycopg2 connection string
+           max_connections -- upper bound on open connections; callers wait for a free one beyond it
+           retries / backoff -- connection attempts, waiting backoff * 2^attempt seconds between them
+           health_check_interval -- connections idle for longer are checked with SELECT 1 before reuse
+
+       Example:
+           >>> pool = ppy_sql.connection_pool(dsn, max_connections = 4)
+           >>> with pool.transaction() as cursor:
+           ...     cursor.execute('SELECT 1')
+    """
+    def __init__(self, dsn: str, min_connections: int = 1, max_connections: int = 5, retries: int = 5, backoff: float = 0.5, health_check_interval: float = 30):
+        self.dsn = dsn
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.retries = retries
+        self.backoff = backoff
+        self.health_check_interval = health_check_interval
+
+        self.pool = None
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(max_connections)
+        # Keyed by the connection itself, so entries go with it (an id() may be reused by a later connection)
+        self.last_used = weakref.WeakKeyDictionary()
+
+    def retry(self, func):
+        """Helper Function -- Run func, retrying connection failures with exponential backoff"""
+        for attempt in range(self.retries):
+            try:
+                return(func())
+            except psycopg2.OperationalError as e:
+                if attempt == self.retries - 1:
+                    raise
+                wait = self.backoff * 2 ** attempt
+                print(f"Connection failed, retrying in {wait:.1f}s | {str(e).strip()}")
+                time.sleep(wait)
+
+    def open(self) -> None:
+        with self.lock:
+            if self.pool is None or self.pool.closed:
+                self.pool = self.retry(lambda: psycopg2.pool.ThreadedConnectionPool(self.min_connections, self.max_connections, self.dsn))
+
+    def healthy(self, conn) -> bool:
+        if conn.closed:
+            return(False)
+        if time.monotonic() - self.last_used.get(conn, 0) < self.health_check_interval:
+            return(True)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return(True)
+        except psycopg2.Error:
+            return(False)
+
+    def getconn(self):
+        """Borrow a healthy connection, waiting for a free one if max_connections are in use.
+           Broken connections are discarded & replaced, reconnecting with backoff.
+        """
+        self.open()
+        self.slots.acquire()
+        try:
+            def checkout():
+                # Stale connections are closed, so the pool opens fresh ones in their place
+                for _ in range(self.max_connections + 1):
+                    conn = self.pool.getconn()
+                    if self.healthy(conn):
+                        return(conn)
+                    self.pool.putconn(conn, close = True)
+                raise psycopg2.OperationalError('no healthy connection available')
+            return(self.retry(checkout))
+        except:
+            self.slots.release()
+            raise
+
+    def putconn(self, conn, close: bool = False) -> None:
+        """Return a borrowed connection, rolling back anything left uncommitted"""
+        try:
+            if not conn.closed and conn.status != psycopg2.extensions.STATUS_READY:
+                conn.rollback()
+        except psycopg2.Error:
+            close = True
+        close = close or bool(conn.closed)
+        if close:
+            self.last_used.pop(conn, None)
+        else:
+            self.last_used[conn] = time.monotonic()
+        self.pool.putconn(conn, close = close)
+        self.slots.release()
+
+    @contextmanager
+    def connection(self):
+        """Context manager -- a pooled connection, returned to the pool on exit"""
+        conn = self.getconn()
+        try:
+            yield(conn)
+        finally:
+            self.putconn(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Context manager -- a cursor on a pooled connection, committed on exit or rolled back on error"""
+        with self.connection() as conn:
+            try:
+                with conn.cursor() as cursor:
+                    yield(cursor)
+                conn.commit()
+            except:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+
+    def closeall(self) -> None:
+        with self.lock:
+            if self.pool is not None and not self.pool.closed:
+                self.pool.closeall()
+
+pools = {}
+pools_lock = threading.Lock()
+
+def connection_pool(dsn: str, **kwargs) -> ConnectionPool:
+    """Return the process-wide ConnectionPool for dsn, creating it (with kwargs) on first use"""
+    with pools_lock:
+        if dsn not in pools:
+            pools[dsn] = ConnectionPool(dsn, **kwargs)
+        return(pools[dsn])
+
+# -- COPY Streams ---------------------------------------------------------------------------
+
+# PostgreSQL binary COPY format: https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4
+BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + np.array([0, 0], dtype = '>i4').tobytes()
+BINARY_TRAILER = np.array([-1], dtype = '>i2').tobytes()
+BINARY_FIXED = {'int2' : '>i2', 'int4' : '>i4', 'int8' : '>i8', 'float4' : '>f4', 'float8' : '>f8', 'bool' : '?'}
+BINARY_TEXT = ('text', 'varchar', 'bpchar', 'name')
+BINARY_TYPES = tuple(BINARY_FIXED) + BINARY_TEXT + ('date', 'timestamp', 'timestamptz')
+POSTGRES_EPOCH = np.datetime64('2000-01-01')
+
+def _binary_field(s: pd.Series, pg_type: str) -> tuple:
+    """Encodes one column for binary COPY, returning (null mask, payload lengths, payload bytes as uint8).
+       Fixed-width payloads are (rows, width); text payloads are one flat buffer of the non-null values.
+    """
+    if pg_type in BINARY_TEXT:
+        # Only distinct values are encoded (labels repeat heavily), then gathered per row.
+        # Empty strings are NULL, as in the CSV format & copy_from(..., null = '')
+        codes, uniques = pd.factorize(s)
+        encoded = [str(u).encode('utf-8') for u in uniques]
+        unique_lengths = np.fromiter(map(len, encoded), dtype = 'int64', count = len(encoded))
+        unique_starts = np.cumsum(unique_lengths) - unique_lengths
+        unique_bytes = np.frombuffer(b''.join(encoded), dtype = 'uint8')
+
+        if not encoded:
+            return(np.ones(len(s), dtype = 'bool'), np.zeros(len(s), dtype = 'int64'), unique_bytes)
+
+        codes = np.asarray(codes)
+        row_codes = np.maximum(codes, 0)
+        null = (codes < 0) | (unique_lengths[row_codes] == 0)
+        lengths = np.where(null, 0, unique_lengths[row_codes])
+        value_starts = np.cumsum(lengths) - lengths
+        source = np.repeat(unique_starts[row_codes] - value_starts, lengths) + np.arange(lengths.sum())
+        return(null, lengths, unique_bytes[source])
+
+    if pg_type == 'date':
+        values = pd.to_datetime(s, errors = 'coerce')
+        null = values.isna().to_numpy()
+        values = (values.to_numpy('datetime64[D]') - POSTGRES_EPOCH.astype('datetime64[D]')).astype('int64')
+        dtype = np.dtype('>i4')
+    elif pg_type in ('timestamp', 'timestamptz'):
+        values = pd.to_datetime(s, errors = 'coerce')
+        # timestamptz is sent as UTC; naive values are taken to be UTC already
+        if getattr(values.dt, 'tz', None) is not None:
+            values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+        null = values.isna().to_numpy()
+        values = (values.to_numpy('datetime64[us]') - POSTGRES_EPOCH.astype('datetime64[us]')).astype('int64')
+        dtype = np.dtype('>i8')
+    elif pg_type == 'bool':
+        null = s.isna().to_numpy()
+        values = s.fillna(False).astype('bool').to_numpy()
+        dtype = np.dtype('?')
+    else:
+        values = pd.to_numeric(s, errors = 'coerce')
+        null = values.isna().to_numpy()
+        values = values.to_numpy(dtype = 'float64', na_value = 0) if pg_type.startswith('float') else values.fillna(0).to_numpy().astype('int64')
+        dtype = np.dtype(BINARY_FIXED[pg_type])
+
+    payload = values.astype(dtype).view('uint8').reshape(len(s), dtype.itemsize)
+    lengths = np.where(null, 0, dtype.itemsize).astype('int64')
+    return(null, lengths, payload)
+
+def _scatter(buffer: np.ndarray, positions: np.ndarray, payload: np.ndarray) -> None:
+    """Write row i of a (rows, width) uint8 payload to buffer[positions[i]:positions[i] + width]"""
+    if len(positions):
+        buffer[positions[:, None] + np.arange(payload.shape[1])] = payload
+
+def encode_binary(df: pd.DataFrame, pg_types: list) -> bytes:
+    """Encodes the rows of df as PostgreSQL binary COPY tuples (without the file header & trailer),
+       with vectorized numpy operations rather than a Python loop over rows.
+       pg_types -- the type name (pg_type.typname) of the target column for each column of df
+    """
+    n = len(df)
+    fields = [_binary_field(df.iloc[:, i], t) for i, t in enumerate(pg_types)]
+
+    # Each tuple is a field count (int16), then per field a length (int32, -1 for NULL) & the payload
+    row_sizes = 2 + sum(4 + lengths for _, lengths, _ in fields)
+    row_starts = np.zeros(n, dtype = 'int64')
+    np.cumsum(row_sizes[:-1], out = row_starts[1:])
+    buffer = np.empty(int(row_sizes.sum()), dtype = 'uint8')
+
+    _scatter(buffer, row_starts, np.full(n, len(fields), dtype = '>i2').view('uint8').reshape(n, 2))
+    position = row_starts + 2
+    for null, lengths, payload in fields:
+        _scatter(buffer, position, np.where(null, -1, lengths).astype('>i4').view('uint8').reshape(n, 4))
+        if payload.ndim == 2:
+            keep = ~null
+            _scatter(buffer, position[keep] + 4, payload[keep])
+        elif len(payload):
+            # Destination of each byte of the flat text buffer: its field's position, plus its offset within the value
+            value_starts = np.cumsum(lengths) - lengths
+            buffer[np.repeat(position + 4 - value_starts, lengths) + np.arange(len(payload))] = payload
+        position = position + 4 + lengths
+    return(buffer.tobytes())
 
 class PostgreSQL():
     """Creates a connection to a PostgreSQL database. Layers on the psycopg2 package.
@@ -25,10 +306,11 @@ class PostgreSQL():
            Connected
     """
 
-    def __init__(self, username: str = '', password: str = '', engine: str = '', host: str = '', port: str = '5432', dbname: str = '', dbInstanceIdentifier: str = '', print_info: bool = False):
+    def __init__(self, username: str = '', password: str = '', engine: str = '', host: str = '', port: str = '5432', dbname: str = '', dbInstanceIdentifier: str = '', print_info: bool = False, max_connections: int = 5):
         """Created with user-specified parameters. By default, runs db.connect() to create connection & cursor at instantiation.
            Internally creates the following additional variables:
                connection_string -- the connection string used in the db.connect() method
+               pool -- the process-wide ConnectionPool for these credentials, shared with other PostgreSQL objects
         """
         self.host = host
         self.port = port
@@ -38,11 +320,20 @@ class PostgreSQL():
         self.last_error = ''
         
         self.connection_string = f'host={host} port={port} dbname={dbname} user={username} password={password}'
+        self.pool = connection_pool(self.connection_string, max_connections = max_connections)
+        self.connection = None
         self.connect(print_info = print_info)
 
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *args) -> None:
+        self.disconnect()
+
     def connect(self, print_info:bool = False) -> None:
-        """Create a connection & cursor based on the credentials provided.
+        """Borrow a connection from the pool & create a cursor, used by the methods below.
            This method is run by default upon instantiation of the object.
+           Connection failures are retried with backoff, then raised.
            
            Set print_info = False to disable output of connection_info
            
@@ -50,7 +341,7 @@ class PostgreSQL():
            Connected
         """
         try:
-            self.connection = psycopg2.connect(self.connection_string)
+            self.connection = self.pool.getconn()
             self.cursor = self.connection.cursor()
             print("Connected.")
             
@@ -63,20 +354,62 @@ class PostgreSQL():
             }
             if print_info:
                 pprint.pprint(self.connection_info)
-        except:
+        except psycopg2.Error as e:
             print("Connection failed.")
-            self.connection = json.dumps(sys.exc_info()[0])
+            self.last_error = {'error_code' : e.pgcode, 'error_message' : str(e).strip()}
+            raise
     
     def disconnect(self) -> None:
-        """Close the connection & cursor.
+        """Close the cursor & return the connection to the pool, where it stays open for reuse.
            Run at the end of a script to safely close connections & wrap-up.
            
            >>> db.disconnect()
            Disconnected.
         """
+        if self.connection is None:
+            return
         self.cursor.close()
-        self.connection.close()
+        self.pool.putconn(self.connection)
+        self.connection = None
         print("Disconnected.")
+
+    @contextmanager
+    def pooled_connection(self):
+        """Context manager -- a separate pooled connection, e.g. for work alongside the object's own connection
+
+           >>> with db.pooled_connection() as conn:
+           ...     pd.read_sql('SELECT * FROM dems_fred', conn)
+        """
+        with self.pool.connection() as conn:
+            yield(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Context manager -- a cursor on a separate pooled connection, committed on exit or rolled back on error
+
+           >>> with db.transaction() as cursor:
+           ...     cursor.execute('DELETE FROM dems_fred WHERE fred_date < %s', ('2000-01-01',))
+        """
+        with self.pool.transaction() as cursor:
+            yield(cursor)
+
+    def run_transaction(self, sql: str, params = None, fetch: bool = False):
+        """Execute SQL in its own pooled transaction, returning all rows if fetch. Thread-safe"""
+        with self.transaction() as cursor:
+            cursor.execute(sql, params)
+            return(cursor.fetchall() if fetch else cursor.rowcount)
+
+    async def execute_async(self, sql: str, params = None) -> int:
+        """Awaitable execute & commit on a pooled connection (run in a worker thread), returning the row count
+
+           >>> await asyncio.gather(db.execute_async(sql_a), db.execute_async(sql_b))
+        """
+        return(await asyncio.to_thread(self.run_transaction, sql, params))
+
+    async def fetchall_async(self, sql: str, params = None) -> list:
+        """Awaitable execute & fetchall on a pooled connection (run in a worker thread)
+        """
+        return(await asyncio.to_thread(self.run_transaction, sql, params, True))
     
     def error_message(self, pgcode: str, pgerror: str) -> None:
         """Helper Function -- Store last error in self, print to console & rollback the connection
@@ -84,31 +417,114 @@ class PostgreSQL():
         error = {'error_code' : pgcode, 'error_message' : pgerror}
         self.last_error = error
         print(error)
-        self.connection.rollback()
+        if self.connection.closed:
+            # The server dropped the connection, so replace it from the pool
+            self.pool.putconn(self.connection, close = True)
+            self.connect()
+        else:
+            self.connection.rollback()
         
-    def execute_commit(self, sql: str) -> None:
+    def execute_commit(self, sql: str, params = None) -> None:
         """Utility Function -- Execute user-specifed SQL & commit to connection
+           Optional params are passed to psycopg2 for %s placeholders
         
            >>> db.execute_commit()
         """
         try:
-            self.cursor.execute(sql)
+            self.cursor.execute(sql, params)
             self.connection.commit()
         except psycopg2.Error as e:
             self.error_message(e.pgcode, e.pgerror)
     
-    def execute_fetchall(self, sql: str) -> list:
+    def execute_fetchall(self, sql: str, params = None) -> list:
         """Utility Function -- Execute user-specified SQL & fetch entire result set
+           Optional params are passed to psycopg2 for %s placeholders
         
            >>> db.execute_fetchall('SELECT * FROM table_name')
         """
         try:
-            self.cursor.execute(sql)
+            self.cursor.execute(sql, params)
             rows = self.cursor.fetchall()
             return(rows)
         except psycopg2.Error as e:
             self.error_message(e.pgcode, e.pgerror)
 
+    def stream_query(self, sql: str, params = None, chunk_rows: int = 50000, output: str = 'pandas'):
+        """Runs a query through a named (server-side) cursor on a pooled connection, yielding the result
+           chunk_rows rows at a time, so memory stays bounded however large the result is.
+           Chunks are typed from the column types: nullable integers, floats (NUMERIC included), datetime64 dates & timestamps.
+           output -- 'pandas' for DataFrames, 'arrow' for pyarrow RecordBatches
+
+           >>> for chunk in db.stream_query("SELECT * FROM dems_bls_laus WHERE geo_scope = %s", ('State',)):
+           ...     chunk.to_parquet(...)
+        """
+        with self.pool.connection() as conn:
+            # Named cursors only live within a transaction; the pool rolls it back when the connection is returned
+            with conn.cursor(name = f'stream_{uuid.uuid4().hex}') as cursor:
+                psycopg2.extensions.register_type(NUMERIC_FLOAT, cursor)
+                cursor.itersize = chunk_rows
+                cursor.execute(sql, params)
+                while True:
+                    rows = cursor.fetchmany(chunk_rows)
+                    if not rows:
+                        break
+                    batch = rows_to_arrow(rows, cursor.description)
+                    yield(batch if output == 'arrow' else arrow_to_pandas(batch))
+
+    def export(self, sql: str, params = None, output: str = 'pandas', path: str = '', format: str = 'csv'):
+        """Bulk export of a query through COPY (query) TO STDOUT, much faster than fetching rows for large results.
+           The CSV output is piped into pyarrow's streaming reader as COPY writes it, so it is never held in memory
+           as text, and parsed in C++, typed from the query's column types (as stream_query). Parquet output is
+           written batch by batch, so memory stays bounded however large the result.
+           output -- 'pandas' for a DataFrame, 'arrow' for a pyarrow Table, 'parquet' to write path (returned)
+           format -- 'csv', or 'binary' to write PostgreSQL's binary COPY format to path as-is,
+                     for reloading with COPY ... FROM (FORMAT binary) (e.g. copy_expert)
+
+           >>> db.export('SELECT * FROM dems_bls_laus WHERE laus_date >= %s', ('2020-01-01',))
+           >>> db.export('SELECT * FROM dems_fred', output = 'parquet', path = 'dems_fred.parquet')
+        """
+        with self.pool.connection() as conn, conn.cursor() as cursor:
+            # COPY takes no parameters, so they are bound client-side
+            query = cursor.mogrify(sql, params).decode() if params is not None else sql
+            # Timestamps are exported in UTC & ISO style, which the CSV reader parses
+            cursor.execute("SET LOCAL TimeZone = 'UTC'; SET LOCAL DateStyle = 'ISO'")
+
+            if format == 'binary':
+                with open(path, 'wb') as f:
+                    cursor.copy_expert(f'COPY ({query}) TO STDOUT WITH (FORMAT binary)', f)
+                return(path)
+
+            cursor.execute(f'SELECT * FROM ({query}) export_query LIMIT 0')
+            description = cursor.description
+
+            # COPY writes into a pipe from a worker thread, while the reader parses from the other end
+            read_fd, write_fd = os.pipe()
+            reader, writer = os.fdopen(read_fd, 'rb'), os.fdopen(write_fd, 'wb')
+            def produce():
+                with writer:
+                    cursor.copy_expert(f'COPY ({query}) TO STDOUT WITH (FORMAT csv)', writer)
+
+            with ThreadPoolExecutor(max_workers = 1) as executor:
+                copy = executor.submit(produce)
+                try:
+                    with reader:
+                        stream = csv_to_arrow(reader, description)
+                        if output == 'parquet':
+                            with pq.ParquetWriter(path, stream.schema, compression = 'zstd') as parquet:
+                                for batch in stream:
+                                    parquet.write_batch(batch)
+                        else:
+                            table = stream.read_all()
+                except:
+                    # Closing the reader stops the COPY with a broken pipe, which is secondary to the parsing error
+                    copy.exception()
+                    raise
+                copy.result()
+
+        if output == 'parquet':
+            return(path)
+        return(table if output == 'arrow' else arrow_to_pandas(table))
+
     def copy_from(self, f, table: str, sep: str = '\t', null: str = '\\N') -> None:
         """Wrapper for psycopg2.cursor.copy_from method.
            Provides the following absraction:
@@ -127,6 +543,554 @@ class PostgreSQL():
         except psycopg2.Error as e:
             self.error_message(e.pgcode, e.pgerror)
 
+    def copy_file(self, f, table: str, columns: list = None, sep: str = ',', null: str = '', header: bool = False, size: int = 1024 * 1024) -> int:
+        """Streams a CSV file-like object into COPY ... FROM STDIN, size bytes at a time. With a download stream
+           (e.g. ProbitasBox.get_file_stream) rows load as they arrive & memory stays at one chunk, however large the file.
+           Unlike copy_from, quoted values are understood. Commits the copy, and returns the number of rows copied.
+           columns -- target columns for the file's fields, in order (defaults to the table's columns)
+
+           >>> db.copy_file(box.get_file_stream('657669300653'), 'dems_bls_laus', sep = '\t')
+           Data copied successfully to: dems_bls_laus | 788,544 rows (csv) in 6.2s
+        """
+        target = f' ({", ".join(columns)})' if columns else ''
+        start = time.time()
+        try:
+            sql = self.cursor.mogrify(f'COPY {table}{target} FROM STDIN WITH (FORMAT csv, DELIMITER %s, NULL %s, HEADER {bool(header)})', (sep, null)).decode()
+            self.cursor.copy_expert(sql, f, size = size)
+            rows = self.cursor.rowcount
+            self.connection.commit()
+            print(f"Data copied successfully to: {table} | {rows:,} rows (csv) in {time.time() - start:.1f}s")
+            return(rows)
+        except psycopg2.Error as e:
+            self.error_message(e.pgcode, e.pgerror)
+            return(0)
+
+    def table_types(self, table: str) -> dict:
+        """SQL Helper Function -- Return {column : type name} for the table's columns, in table order
+
+           >>> db.table_types('dems_fred')
+           {'fred_date': 'date', 'geo_scope': 'text', ..., 'value': 'numeric'}
+        """
+        rows = self.execute_fetchall("""
+            SELECT a.attname, t.typname
+            FROM pg_attribute a
+            JOIN pg_type t ON t.oid = a.atttypid
+            WHERE a.attrelid = %s::regclass AND a.attnum > 0 AND NOT a.attisdropped
+            ORDER BY a.attnum
+            """, (table,))
+        return(dict(rows or []))
+
+    def dataframe_columns(self, df: pd.DataFrame, types: dict) -> list:
+        """Helper Function -- Target columns for a DataFrame: its column names when they all exist in the table,
+           otherwise the table's columns, in order (as with copy_from)
+        """
+        return(list(df.columns) if set(df.columns) <= set(types) else list(types)[:len(df.columns)])
+
+    def copy_dataframe(self, df: pd.DataFrame, table: str, columns: list = None, binary: bool = True, chunk_rows: int = 100000) -> int:
+        """Streams a DataFrame straight into COPY ... FROM STDIN, without writing a file.
+           Rows are encoded chunk_rows at a time as they are sent, so the full payload never sits in memory:
+               0. Uses the binary COPY format when every target column has a type it can encode
+                  (integers, floats, bool, text, date & timestamp), otherwise CSV. Empty strings load as NULL
+               1. Commits the copy, and returns the number of rows copied. Errors are handled by self.error_message()
+           columns -- target columns for the DataFrame's columns, in order. Defaults to the DataFrame's column
+                      names when they all exist in the table, otherwise the table's columns, in order (as with copy_from)
+
+           >>> db.copy_dataframe(master, 'dems_fred')
+           Data copied successfully to: dems_fred | 1,024,000 rows (binary) in 2.1s
+        """
+        types = self.table_types(table)
+        columns = columns or self.dataframe_columns(df, types)
+        sql, stream, binary = self.copy_stream(df, table, columns, types, binary, chunk_rows)
+        start = time.time()
+        try:
+            self.cursor.copy_expert(sql, stream, size = 1024 * 1024)
+            self.connection.commit()
+            print(f"Data copied successfully to: {table} | {len(df):,} rows ({'binary' if binary else 'csv'}) in {time.time() - start:.1f}s")
+            return(len(df))
+        except psycopg2.Error as e:
+            self.error_message(e.pgcode, e.pgerror)
+            return(0)
+
+    def copy_stream(self, df: pd.DataFrame, table: str, columns: list, types: dict, binary: bool = True, chunk_rows: int = 100000) -> tuple:
+        """Helper Function -- Returns (COPY statement, file-like stream of df encoded chunk_rows at a time, whether binary)
+           for copy_expert, as used by copy_dataframe & parallel_copy
+        """
+        pg_types = [types.get(c) for c in columns]
+        binary = binary and all(t in BINARY_TYPES for t in pg_types)
+
+        def chunks():
+            if binary:
+                yield BINARY_HEADER
+            for start in range(0, len(df), chunk_rows):
+                chunk = df.iloc[start:start + chunk_rows]
+                if binary:
+                    yield encode_binary(chunk, pg_types)
+                else:
+                    yield chunk.to_csv(index = False, header = False).encode('utf-8')
+            if binary:
+                yield BINARY_TRAILER
+
+        sql = f'COPY {table} ({", ".join(columns)}) FROM STDIN WITH (FORMAT {"binary" if binary else "csv"})'
+        return(sql, ChunkedStream(chunks()), binary)
+
+    def parallel_copy(self, df, table: str, partition_by: str, connections: int = 4, columns: list = None, partition_years: int = 10, binary: bool = True, chunk_rows: int = 100000) -> dict:
+        """Loads a DataFrame (or a Parquet or CSV file) over several concurrent COPY streams, one per pooled connection,
+           so the load is not capped by a single backend process:
+               0. Splits the rows on partition_by: per value (e.g. geo_scope), or for a date column, per range of
+                  partition_years (matching the table partitions of ppy_schema)
+               1. Workers, each holding one pooled connection & one open transaction, take partitions largest first
+                  and stream them as copy_dataframe does
+               2. Commits every connection once all partitions have loaded, or rolls them all back if any failed.
+                  When the server allows prepared transactions (max_prepared_transactions), each worker first PREPAREs
+                  its transaction (two-phase commit), so the commit cannot fail part way through
+           connections -- concurrent COPY streams, capped by the pool size less this object's own connection
+           Returns {partition : {'rows', 'seconds', 'rows_per_second'}}, or None if the load was rolled back.
+
+           >>> db.parallel_copy(master, 'dems_bls_laus_new', partition_by = 'laus_date', connections = 4)
+           Partition copied: dems_bls_laus_new | 1990 | 120,864 rows in 1.1s | 109,876 rows/s
+        """
+        if isinstance(df, str):
+            df = pd.read_parquet(df) if df.endswith('.parquet') else pd.read_csv(df)
+        types = self.table_types(table)
+        columns = columns or self.dataframe_columns(df, types)
+
+        key = df[partition_by]
+        target = dict(zip(df.columns, columns)).get(partition_by)
+        if pd.api.types.is_datetime64_any_dtype(key) or types.get(target) in ('date', 'timestamp', 'timestamptz'):
+            key = pd.to_datetime(key).dt.year // partition_years * partition_years
+        partitions = {(k.item() if isinstance(k, np.generic) else k) : rows for k, rows in df.groupby(key, dropna = False, observed = True, sort = False).indices.items()}
+        pending = queue.Queue()
+        for k in sorted(partitions, key = lambda k: -len(partitions[k])):
+            pending.put(k)
+
+        workers = max(min(connections, len(partitions), self.pool.max_connections - 1), 1)
+        prepared = self.execute_fetchall('SHOW max_prepared_transactions')
+        two_phase = bool(prepared) and int(prepared[0][0]) >= workers
+        gid = uuid.uuid4().hex
+        results, failures = {}, []
+
+        def work(i: int, conn) -> None:
+            try:
+                if two_phase:
+                    conn.tpc_begin(conn.xid(0, f'{table}_{gid}_{i}', 'parallel_copy'))
+                with conn.cursor() as cursor:
+                    while not failures:
+                        try:
+                            k = pending.get_nowait()
+                        except queue.Empty:
+                            break
+                        part = df.take(partitions[k])
+                        sql, stream, is_binary = self.copy_stream(part, table, columns, types, binary, chunk_rows)
+                        start = time.time()
+                        cursor.copy_expert(sql, stream, size = 1024 * 1024)
+                        seconds = time.time() - start
+                        results[k] = {'rows' : len(part), 'seconds' : seconds, 'rows_per_second' : len(part) / max(seconds, 1e-9)}
+                        print(f"Partition copied: {table} | {k} | {len(part):,} rows in {seconds:.1f}s | {results[k]['rows_per_second']:,.0f} rows/s")
+                if two_phase and not failures:
+                    conn.tpc_prepare()
+            except Exception as e:
+                failures.append(e)
+
+        start = time.time()
+        conns = []
+        try:
+            # Checked out inside the try, so connections already borrowed go back should a later checkout fail
+            for _ in range(workers):
+                conns.append(self.pool.getconn())
+            with ThreadPoolExecutor(workers) as executor:
+                list(executor.map(work, range(workers), conns))
+            # One outcome for every connection. A prepared transaction which fails to commit (e.g. on a lost connection)
+            # stays prepared on the server, see pg_prepared_xacts
+            commit = not failures
+            for conn in conns:
+                try:
+                    if commit:
+                        conn.tpc_commit() if two_phase else conn.commit()
+                    else:
+                        conn.tpc_rollback() if two_phase else conn.rollback()
+                except psycopg2.Error as e:
+                    failures.append(e)
+        finally:
+            for conn in conns:
+                self.pool.putconn(conn)
+
+        if failures:
+            e = failures[0]
+            if not isinstance(e, psycopg2.Error):
+                raise e
+            self.error_message(e.pgcode, e.pgerror)
+            return(None)
+        rows = sum(r['rows'] for r in results.values())
+        seconds = time.time() - start
+        print(f"Data copied successfully to: {table} | {rows:,} rows over {workers} connections{' (two-phase)' if two_phase else ''} in {seconds:.1f}s | {rows / max(seconds, 1e-9):,.0f} rows/s")
+        return(results)
+
+    def qualify(self, expression: str, alias: str, columns) -> str:
+        """Helper Function -- Prefix the table's column names in a SQL expression with alias
+        
+           >>> db.qualify('COALESCE(fips_area, 0)', 't', ['fips_area'])
+           'COALESCE(t.fips_area, 0)'
+        """
+        pattern = r'(?<![.\w])(' + '|'.join(re.escape(c) for c in columns) + r')(?![\w(])'
+        # Odd parts of the split are string literals, left as they are
+        parts = expression.split("'")
+        return("'".join(p if i % 2 else re.sub(pattern, alias + r'.\1', p) for i, p in enumerate(parts)))
+
+    def upsert_dataframe(self, df: pd.DataFrame, table: str, keys: list, columns: list = None, ignore: list = None, prune: str = '') -> dict:
+        """Incremental load which keeps the table fully readable throughout:
+               0. Streams df into an UNLOGGED staging table (see copy_dataframe)
+               1. Merges it with INSERT ... ON CONFLICT on the natural key, in one transaction. Rows whose values
+                  (other than the keys & ignore columns, e.g. load timestamps) are unchanged are not rewritten
+               2. Optionally, deletes rows matching the prune filter which are not in df, in the same transaction
+                  (e.g. prune = "geo_scope = 'Metropolitan Area'" when all metro rows are reloaded)
+           keys -- the natural key, as columns or expressions (e.g. 'COALESCE(fips_area, 0)', as a unique index
+                   treats NULLs as distinct), which should not be NULL. A unique index on them is created if missing;
+                   rows already duplicating a key are removed first, keeping the most recently written one
+           Returns the number of inserted, updated, unchanged & deleted rows.
+
+           >>> db.upsert_dataframe(master, 'dems_fred', ['geo_scope', 'geo_abbreviation', 'variable', 'fred_date'],
+                                   ignore = ['data_loaded_on', 'data_loaded_by'])
+           Upserted into: dems_fred | inserted: 52 | updated: 12 | unchanged: 140,331 | deleted: 0
+        """
+        types = self.table_types(table)
+        columns = columns or self.dataframe_columns(df, types)
+        ignore = ignore or []
+        staging = f'{table}_staging'
+        # Expressions are parenthesised, as index definitions & ON CONFLICT require
+        key_list = ', '.join(k if k.isidentifier() else f'({k})' for k in keys)
+        compare = [c for c in columns if c not in keys and c not in ignore]
+
+        errors = self.last_error
+        self.create_unique_index(table, keys)
+        self.execute_commit(f'DROP TABLE IF EXISTS {staging}; CREATE UNLOGGED TABLE {staging} (LIKE {table} INCLUDING DEFAULTS)')
+        if self.last_error is not errors or not self.copy_dataframe(df, staging, columns = columns):
+            return(None)
+
+        try:
+            # DISTINCT ON, as a key may only be affected once per INSERT; xmax = 0 marks freshly inserted rows
+            self.cursor.execute(f"""
+                WITH upserted AS (
+                    INSERT INTO {table} AS t ({", ".join(columns)})
+                    SELECT DISTINCT ON ({key_list}) {", ".join(columns)}
+                    FROM {staging}
+                    ORDER BY {key_list}
+                    ON CONFLICT ({key_list}) DO UPDATE
+                    SET {", ".join(f'{c} = EXCLUDED.{c}' for c in columns)}
+                    {f'WHERE ({", ".join("t." + c for c in compare)}) IS DISTINCT FROM ({", ".join("EXCLUDED." + c for c in compare)})' if compare else 'WHERE FALSE'}
+                    RETURNING (xmax = 0) AS inserted
+                )
+                SELECT
+                    COUNT(*) FILTER (WHERE inserted),
+                    COUNT(*) FILTER (WHERE NOT inserted),
+                    (SELECT COUNT(*) FROM (SELECT DISTINCT {key_list} FROM {staging}) k)
+                FROM upserted
+                """)
+            inserted, updated, staged = self.cursor.fetchone()
+
+            deleted = 0
+            if prune:
+                # Anti-join on the keys, qualified per side, so it can run as a hash join
+                match = ' AND '.join(f'{self.qualify(k, "t", types)} = {self.qualify(k, "s", types)}' for k in keys)
+                self.cursor.execute(f"""
+                    DELETE FROM {table} t
+                    WHERE ({self.qualify(prune, 't', types)})
+                        AND NOT EXISTS (SELECT 1 FROM {staging} s WHERE {match})
+                    """)
+                deleted = self.cursor.rowcount
+
+            self.cursor.execute(f'DROP TABLE {staging}')
+            self.connection.commit()
+            result = {'inserted' : inserted, 'updated' : updated, 'unchanged' : staged - inserted - updated, 'deleted' : deleted}
+            print(f"Upserted into: {table} | " + ' | '.join(f'{k}: {v:,}' for k,v in result.items()))
+            return(result)
+        except psycopg2.Error as e:
+            self.error_message(e.pgcode, e.pgerror)
+
+    def create_unique_index(self, table: str, keys: list) -> None:
+        """Creates the {table}_natural_key unique index on keys (columns or expressions) if it is missing.
+           A table loaded without one may already hold duplicate keys, which would make the index fail, so those
+           are deleted first, keeping the most recently written row per key, in the same transaction.
+
+           >>> db.create_unique_index('dems_fred', ['geo_scope', 'geo_abbreviation', 'variable', 'fred_date'])
+        """
+        name = f'{table}_natural_key'
+        if self.execute_fetchall('SELECT 1 FROM pg_indexes WHERE schemaname = current_schema() AND indexname = %s', (name,)):
+            return
+        key_list = ', '.join(k if k.isidentifier() else f'({k})' for k in keys)
+        try:
+            # tableoid & ctid identify a row within a partitioned table; a key's duplicates share a partition
+            self.cursor.execute(f"""
+                DELETE FROM {table} t
+                USING (
+                    SELECT tableoid, ctid, ROW_NUMBER() OVER (PARTITION BY {key_list} ORDER BY xmin::text::bigint DESC, ctid DESC) AS n
+                    FROM {table}
+                ) d
+                WHERE t.tableoid = d.tableoid
+                    AND t.ctid = d.ctid
+                    AND d.n > 1
+                """)
+            if self.cursor.rowcount:
+                print(f"Duplicate keys removed from: {table} | {self.cursor.rowcount:,} rows")
+            self.cursor.execute(f'CREATE UNIQUE INDEX {name} ON {table} ({key_list})')
+            self.connection.commit()
+        except psycopg2.Error as e:
+            self.error_message(e.pgcode, e.pgerror)
+
+    def dependent_views(self, table: str) -> list:
+        """Views & materialized views built on the table or its partitions (directly or through other views),
+           in the order they can be recreated: [(name, relkind, definition, [index definitions])]
+        """
+        self.cursor.execute("""
+            WITH RECURSIVE tables AS (
+                SELECT to_regclass(%(table)s) AS oid
+                UNION
+                SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%(table)s)
+            ), views AS (
+                SELECT r.ev_class AS oid, 1 AS depth
+                FROM pg_depend d
+                JOIN pg_rewrite r ON r.oid = d.objid
+                WHERE d.refobjid IN (SELECT oid FROM tables)
+                    AND r.ev_class NOT IN (SELECT oid FROM tables)
+                UNION ALL
+                SELECT r.ev_class, v.depth + 1
+                FROM views v
+                JOIN pg_depend d ON d.refobjid = v.oid
+                JOIN pg_rewrite r ON r.oid = d.objid
+                WHERE r.ev_class <> v.oid
+            )
+            SELECT c.oid::regclass::text, c.relkind, pg_get_viewdef(c.oid),
+                ARRAY(SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i WHERE i.indrelid = c.oid)
+            FROM views v
+            JOIN pg_class c ON c.oid = v.oid
+            GROUP BY c.oid, c.relkind
+            ORDER BY MAX(v.depth)
+            """, {'table' : table})
+        return(self.cursor.fetchall())
+
+    def swap_dataframe(self, df, table: str, columns: list = None, schema = None, partition_by: str = None, connections: int = 4, sep: str = ',') -> int:
+        """Full reload which keeps the table fully readable throughout, instead of drop, create & copy:
+               0. Streams df into a new table with the same columns & defaults (see copy_dataframe)
+               1. Builds the old table's indexes on it after the copy, and runs ANALYZE
+               2. In one transaction, drops the old table & renames the new one (and its indexes) into place
+           Readers see the old rows until the swap commits, then the new ones. Returns the number of rows loaded.
+           Views & materialized views on the table are dropped & recreated from their definitions in the same
+           transaction (materialized views are refreshed by it); their grants & comments are not carried over.
+           schema -- a ppy_schema.Table to create the new table, its partitions & indexes from, rather than copying
+                     the old table's definition (which does not carry partitioning over). Also migrates an existing
+                     table to the definition
+           partition_by / connections -- load over several connections with parallel_copy, e.g. partition_by = 'laus_date'
+           df may also be a CSV file-like object (without header, delimited by sep) in the table's column order,
+           streamed in with copy_file, e.g. ProbitasBox.get_file_stream
+
+           >>> db.swap_dataframe(master, 'dems_bls_laus', schema = ppy_schema.dems_bls_laus)
+           Swapped in: dems_bls_laus | 788,544 rows
+        """
+        new = f'{table}_new'
+        indexes = [] if schema else self.execute_fetchall(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = %s", (table,)) or []
+
+        def discard() -> None:
+            # The new table is dropped whenever the swap does not complete, rather than left for the next load
+            if not self.connection.closed:
+                self.connection.rollback()
+            self.execute_commit(f'DROP TABLE IF EXISTS {new}')
+
+        errors = self.last_error
+        self.execute_commit(f'DROP TABLE IF EXISTS {new}')
+        if schema:
+            self.execute_commit(schema.create_sql(new))
+        else:
+            self.execute_commit(f'CREATE TABLE {new} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        try:
+            if self.last_error is errors and not isinstance(df, pd.DataFrame):
+                rows = self.copy_file(df, new, columns = columns, sep = sep)
+            elif self.last_error is errors and partition_by:
+                results = self.parallel_copy(df, new, partition_by, connections = connections, columns = columns)
+                rows = sum(r['rows'] for r in results.values()) if results is not None else 0
+            else:
+                rows = self.copy_dataframe(df, new, columns = columns) if self.last_error is errors else 0
+        except:
+            discard()
+            raise
+        if self.last_error is not errors:
+            discard()
+            return(None)
+
+        try:
+            for sql in schema.index_sql(new) if schema else []:
+                self.cursor.execute(sql)
+            for name, definition in indexes:
+                self.cursor.execute(re.sub(r'INDEX \S+ ON (ONLY )?\S+', f'INDEX {name}_new ON {new}', definition, count = 1))
+            self.cursor.execute(f'ANALYZE {new}')
+            self.connection.commit()
+
+            # Dependent views would block the drop, so they are recreated on the new table
+            views = self.dependent_views(table)
+            self.cursor.execute(f'DROP TABLE IF EXISTS {table}{" CASCADE" if views else ""}')
+            self.cursor.execute(f'ALTER TABLE {new} RENAME TO {table}')
+            for name, _ in indexes:
+                self.cursor.execute(f'ALTER INDEX {name}_new RENAME TO {name}')
+            # Partitions & indexes created from the schema are named after the table
+            self.cursor.execute("""
+                SELECT relname, relkind FROM pg_class
+                WHERE relnamespace = current_schema()::regnamespace AND starts_with(relname, %s)
+                """, (f'{new}_',))
+            for name, kind in self.cursor.fetchall():
+                self.cursor.execute(f'ALTER {"INDEX" if kind in ("i", "I") else "TABLE"} {name} RENAME TO {table}{name[len(new):]}')
+            for name, kind, definition, view_indexes in views:
+                self.cursor.execute(f'CREATE {"MATERIALIZED VIEW" if kind == "m" else "VIEW"} {name} AS {definition}')
+                for sql in view_indexes:
+                    self.cursor.execute(sql)
+            self.connection.commit()
+            print(f"Swapped in: {table} | {rows:,} rows")
+            return(rows)
+        except psycopg2.Error as e:
+            self.error_message(e.pgcode, e.pgerror)
+            discard()
+        except:
+            discard()
+            raise
+
+    def merge_vintage(self, f, table: str, keys: list, columns: list, realtime_start: str = None, value: str = 'value', sep: str = '\t', null: str = '\\N') -> dict:
+        """Merges values into a revision-compact (vintage) table.
+           The table stores one row per value per real-time period, [realtime_start, realtime_end),
+           with realtime_end = '9999-12-31' for values which are still current. f is copied into a
+           temporary staging table, then merged as a single transaction.
+
+           With realtime_start, f is a snapshot of current values, first seen on realtime_start:
+               1. Closes current rows whose value was revised, setting realtime_end to realtime_start
+               2. Inserts new & revised rows as current from realtime_start. Unchanged values add no rows
+           Without it, f holds the real-time periods as published (e.g. ALFRED's output_type 1), so columns
+           include realtime_start & realtime_end. For each key, the periods from its earliest realtime_start
+           on replace those stored:
+               1. Deletes stored periods starting on or after it, and closes the period spanning it
+               2. Extends the closed period instead when its value is unchanged, as ALFRED clips the first
+                  period to the requested realtime_start
+               3. Inserts the remaining periods
+           Returns the number of revised (closed) & inserted rows.
+
+           >>> db.merge_vintage(f, 'dems_fred_vintages', ['geo_scope', 'geo_abbreviation', 'variable', 'fred_date'],
+                                ['fred_date', 'geo_scope', 'geo_abbreviation', 'variable', 'value'], '2020-06-11')
+           {'revised': 52, 'inserted': 104}
+           >>> db.merge_vintage(f, 'dems_fred_vintages', ['geo_scope', 'geo_abbreviation', 'variable', 'fred_date'],
+                                ['fred_date', 'geo_scope', 'geo_abbreviation', 'variable', 'value', 'realtime_start', 'realtime_end'])
+        """
+        staging = f'{table}_staging'
+        match = ' AND '.join(f't.{k} = s.{k}' for k in keys)
+        try:
+            self.cursor.execute(f'DROP TABLE IF EXISTS {staging}')
+            self.cursor.execute(f'CREATE TEMP TABLE {staging} AS SELECT {", ".join(columns)} FROM {table} WITH NO DATA')
+            self.cursor.copy_from(f, staging, sep = sep, null = null, columns = columns)
+
+            if realtime_start is not None:
+                revised, inserted = self._merge_snapshot(table, staging, match, columns, realtime_start, value)
+            else:
+                revised, inserted = self._merge_periods(table, staging, match, keys, columns, value)
+
+            self.cursor.execute(f'DROP TABLE {staging}')
+            self.connection.commit()
+            print(f"Vintage merged into: {table} | revised: {revised} | inserted: {inserted}")
+            return({'revised' : revised, 'inserted' : inserted})
+        except psycopg2.Error as e:
+            self.error_message(e.pgcode, e.pgerror)
+
+    def _merge_snapshot(self, table: str, staging: str, match: str, columns: list, realtime_start: str, value: str) -> tuple:
+        self.cursor.execute(f"""
+            UPDATE {table} t
+            SET realtime_end = %(realtime_start)s
+            FROM {staging} s
+            WHERE {match}
+                AND t.realtime_end = '9999-12-31'
+                AND t.{value} IS DISTINCT FROM s.{value}
+            """, {'realtime_start' : realtime_start})
+        revised = self.cursor.rowcount
+
+        self.cursor.execute(f"""
+            INSERT INTO {table} ({", ".join(columns)}, realtime_start, realtime_end)
+            SELECT {", ".join('s.' + c for c in columns)}, %(realtime_start)s, '9999-12-31'
+            FROM {staging} s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM {table} t
+                WHERE {match}
+                    AND t.realtime_end > %(realtime_start)s
+                    AND t.{value} IS NOT DISTINCT FROM s.{value}
+            )
+            """, {'realtime_start' : realtime_start})
+        return(revised, self.cursor.rowcount)
+
+    def _merge_periods(self, table: str, staging: str, match: str, keys: list, columns: list, value: str) -> tuple:
+        # Earliest published period per key, from which the stored periods are replaced
+        window = f'{staging}_window'
+        self.cursor.execute(f'DROP TABLE IF EXISTS {window}')
+        self.cursor.execute(f"""
+            CREATE TEMP TABLE {window} AS
+            SELECT DISTINCT ON ({", ".join(keys)}) {", ".join(keys)}, realtime_start, {value}
+            FROM {staging}
+            ORDER BY {", ".join(keys)}, realtime_start
+            """)
+
+        self.cursor.execute(f"""
+            DELETE FROM {table} t
+            USING {window} s
+            WHERE {match}
+                AND t.realtime_start >= s.realtime_start
+            """)
+
+        self.cursor.execute(f"""
+            UPDATE {table} t
+            SET realtime_end = s.realtime_start
+            FROM {window} s
+            WHERE {match}
+                AND t.realtime_start < s.realtime_start
+                AND t.realtime_end > s.realtime_start
+                AND t.{value} IS DISTINCT FROM s.{value}
+            """)
+        revised = self.cursor.rowcount
+
+        # Unchanged values continue the stored period, rather than starting a new one
+        self.cursor.execute(f"""
+            WITH continued AS (
+                UPDATE {table} t
+                SET realtime_end = s.realtime_end
+                FROM {staging} s
+                JOIN {window} w USING ({", ".join(keys)}, realtime_start)
+                WHERE {match}
+                    AND t.realtime_start < s.realtime_start
+                    AND t.realtime_end >= s.realtime_start
+                    AND t.{value} IS NOT DISTINCT FROM s.{value}
+                RETURNING {", ".join('t.' + k for k in keys)}
+            )
+            DELETE FROM {staging} s
+            USING continued t, {window} w
+            WHERE {match}
+                AND {' AND '.join(f'w.{k} = s.{k}' for k in keys)}
+                AND s.realtime_start = w.realtime_start
+            """)
+
+        self.cursor.execute(f"""
+            INSERT INTO {table} ({", ".join(columns)})
+            SELECT {", ".join(columns)} FROM {staging}
+            """)
+        inserted = self.cursor.rowcount
+        self.cursor.execute(f'DROP TABLE {window}')
+        return(revised, inserted)
+
+    def as_of(self, table: str, as_of_date: str, columns: list = None, where: str = '', params: dict = None) -> list:
+        """Point-in-time read of a vintage table (see merge_vintage): returns each row's value as it
+           was known on as_of_date. Optional where is ANDed to the filter, with %(name)s placeholders from params.
+           Benefits from an index on the table's keys & realtime_start.
+
+           >>> db.as_of('dems_fred_vintages', '2020-04-01', ['fred_date', 'value'], "variable = %(variable)s", {'variable' : 'ICSA'})
+        """
+        sql = f"""
+            SELECT {", ".join(columns or ['*'])}
+            FROM {table}
+            WHERE realtime_start <= %(as_of_date)s
+                AND realtime_end > %(as_of_date)s
+                {'AND (' + where + ')' if where else ''}
+            """
+        return(self.execute_fetchall(sql, {**(params or {}), 'as_of_date' : as_of_date}))
+
     def drop_table(self, table: str) -> None:
         """SQL Helper Function -- Drop the user-specified table
            Uses IF EXISTS to avoid errors
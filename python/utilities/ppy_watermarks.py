@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Persistent per-series watermarks, used to pull only new observations from incremental sources
+"""
+
+# -- Imports --------------------------------------------------------------------------------
+import os, sqlite3
+from datetime import datetime, timedelta
+
+class Watermarks():
+    """Records the last observation date per series in a local SQLite database.
+       Watermarks are namespaced by source (e.g. 'fred', 'bls'), so one file can serve several flows.
+           source -- namespace for the series IDs
+           path -- location of the SQLite file (defaults to watermarks.sqlite in the working directory)
+
+       Example:
+           >>> marks = ppy_watermarks.Watermarks('fred')
+           >>> marks.start_date('ICSA', lookback_days = 90)
+           '2020-03-08'
+    """
+
+    def __init__(self, source: str, path: str = ''):
+        self.source = source
+        self.path = path or os.path.join(os.getcwd(), 'watermarks.sqlite')
+
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS watermarks(
+                source TEXT,
+                series_id TEXT,
+                last_observation TEXT,
+                updated_on TEXT,
+                PRIMARY KEY (source, series_id)
+            )
+            """)
+        self.connection.commit()
+
+    def get(self, series_id: str) -> str:
+        """Return the last observation date (YYYY-MM-DD) stored for series_id, or None
+
+           >>> marks.get('ICSA')
+           '2020-06-06'
+        """
+        row = self.connection.execute(
+            'SELECT last_observation FROM watermarks WHERE source = ? AND series_id = ?',
+            (self.source, series_id)).fetchone()
+        return(row[0] if row else None)
+
+    def get_all(self) -> dict:
+        """Return all watermarks for this source as {series_id : last_observation}
+        """
+        rows = self.connection.execute(
+            'SELECT series_id, last_observation FROM watermarks WHERE source = ?',
+            (self.source,)).fetchall()
+        return(dict(rows))
+
+    def start_date(self, series_id: str, lookback_days: int = 0) -> str:
+        """Return the date to request data from for series_id: the watermark less a revision look-back window.
+           Returns None when no watermark exists, meaning the full history should be pulled.
+
+           >>> marks.start_date('ICSA', lookback_days = 90)
+           '2020-03-08'
+        """
+        return(self.start_dates([series_id], lookback_days).get(series_id))
+
+    def start_dates(self, series_ids: list, lookback_days: int = 0) -> dict:
+        """Return start_date for each series ID as {series_id : start_date}
+        """
+        marks = self.get_all()
+        starts = {}
+        for series_id in series_ids:
+            last_observation = marks.get(series_id)
+            if last_observation is None:
+                starts[series_id] = None
+            else:
+                start = datetime.strptime(last_observation, '%Y-%m-%d') - timedelta(days = lookback_days)
+                starts[series_id] = start.strftime('%Y-%m-%d')
+        return(starts)
+
+    def update(self, last_observations: dict) -> None:
+        """Store {series_id : last_observation} watermarks. Run only once the data has been loaded,
+           so a failed load is picked up again by the next run.
+
+           >>> marks.update({'ICSA' : '2020-06-06'})
+        """
+        updated_on = datetime.now().isoformat()
+        rows = [(self.source, k, v, updated_on) for k,v in last_observations.items()]
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO watermarks (source, series_id, last_observation, updated_on) VALUES (?, ?, ?, ?)',
+            rows)
+        self.connection.commit()
+
+    def reset(self, series_ids: list = None) -> None:
+        """Remove watermarks for the given series IDs (or all series for this source), forcing a full pull
+        """
+        if series_ids is None:
+            self.connection.execute('DELETE FROM watermarks WHERE source = ?', (self.source,))
+        else:
+            self.connection.executemany(
+                'DELETE FROM watermarks WHERE source = ? AND series_id = ?',
+                [(self.source, s) for s in series_ids])
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
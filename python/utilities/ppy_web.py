@@ -3,11 +3,168 @@
 """
 
 # -- Imports --------------------------------------------------------------------------------
+import os, json, time, sqlite3, hashlib, logging, threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
 import requests
 from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
 from urllib3.util import Retry
 from requests.auth import HTTPBasicAuth
 
+# -- Cache ----------------------------------------------------------------------------------
+
+class ResponseCache():
+    """On-disk HTTP response cache, stored in SQLite so it can be shared by many sessions & runs.
+       Entries are keyed by method, URL (including query parameters) and request body, less any API keys
+       (credential_params), so requests made with different keys of a pool share entries.
+           path -- location of the SQLite file (defaults to http_cache.sqlite in the working directory)
+           ttl -- {url_prefix : seconds}, the longest matching prefix sets an entry's time-to-live
+           default_ttl -- time-to-live in seconds for URLs without a matching prefix, 0 disables caching
+           max_bytes -- size bound, least recently used entries are evicted beyond it
+           logger -- logger for cache hits & misses, e.g. the flow's Prefect logger (defaults to this module's logger)
+
+       >>> cache = ResponseCache(ttl = {'https://api.stlouisfed.org/fred/' : 43200})
+       >>> r = create_session(cache = cache)
+    """
+    def __init__(self, path: str = '', ttl: dict = None, default_ttl: int = 3600, max_bytes: int = 512 * 1024 * 1024, logger = None):
+        self.path = path or os.path.join(os.getcwd(), 'http_cache.sqlite')
+        self.ttl = ttl or {}
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self.logger = logger or logging.getLogger(__name__)
+
+        self.lock = threading.Lock()
+        self.inflight_lock = threading.Lock()
+        self.inflight = {}
+
+        self.connection = sqlite3.connect(self.path, check_same_thread = False)
+        with self.lock:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS responses(
+                    key TEXT PRIMARY KEY,
+                    url TEXT,
+                    status INTEGER,
+                    headers TEXT,
+                    content BLOB,
+                    size INTEGER,
+                    expires REAL,
+                    accessed REAL
+                )
+                """)
+            self.connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+            self.connection.commit()
+
+    credential_params = ('api_key', 'registrationkey')
+
+    def strip_credentials(self, url: str, body = None) -> tuple:
+        parts = urlsplit(url)
+        query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values = True) if k not in self.credential_params]
+        url = urlunsplit(parts._replace(query = urlencode(query)))
+        try:
+            data = json.loads(body) if body else None
+        except (ValueError, UnicodeDecodeError):
+            data = None
+        if isinstance(data, dict):
+            body = json.dumps({k:v for k,v in data.items() if k not in self.credential_params}, sort_keys = True)
+        return(url, body)
+
+    def make_key(self, method: str, url: str, body = None) -> str:
+        url, body = self.strip_credentials(url, body)
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        digest = hashlib.sha256()
+        for part in [method.upper().encode('utf-8'), url.encode('utf-8'), body or b'']:
+            digest.update(part)
+            digest.update(b'\x00')
+        return(digest.hexdigest())
+
+    def get_ttl(self, url: str) -> int:
+        prefixes = [k for k in self.ttl if url.startswith(k)]
+        if prefixes:
+            return(self.ttl[max(prefixes, key = len)])
+        return(self.default_ttl)
+
+    def get(self, key: str, url: str = ''):
+        """Return (status, headers, content) for a fresh entry, or None
+        """
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute('SELECT status, headers, content, expires FROM responses WHERE key = ?', (key,)).fetchone()
+            hit = row is not None and row[3] >= now
+            if hit:
+                self.connection.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+                self.connection.commit()
+        # Log without the query string, which can carry API keys
+        if not hit:
+            self.misses += 1
+            self.logger.info(f"cache miss | {url.split('?')[0]} | {key[:12]}")
+            return(None)
+        self.hits += 1
+        self.logger.info(f"cache hit | {url.split('?')[0]} | {key[:12]}")
+        return(row[0], json.loads(row[1]), row[2])
+
+    def set(self, key: str, url: str, status: int, headers: dict, content: bytes) -> None:
+        ttl = self.get_ttl(url)
+        if ttl <= 0 or content is None:
+            return
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO responses (key, url, status, headers, content, size, expires, accessed) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, url.split('?')[0], status, json.dumps(dict(headers)), content, len(content), now + ttl, now))
+            self.evict()
+            self.connection.commit()
+
+    def evict(self) -> None:
+        """Drop expired entries, then least recently used entries until the cache fits in max_bytes.
+           Expects self.lock to be held.
+        """
+        self.connection.execute('DELETE FROM responses WHERE expires < ?', (time.time(),))
+        total = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self.connection.execute('SELECT key, size FROM responses ORDER BY accessed').fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self.connection.executemany('DELETE FROM responses WHERE key = ?', evicted)
+
+    def delete(self, key: str) -> None:
+        """Remove a single entry, e.g. an error payload the API returned with a 200 status
+        """
+        with self.lock:
+            self.connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self.connection.commit()
+
+    def clear(self) -> None:
+        with self.lock:
+            self.connection.execute('DELETE FROM responses')
+            self.connection.commit()
+
+    @contextmanager
+    def single_flight(self, key: str):
+        """Serialize identical requests, so concurrent callers wait for the first response instead of repeating it
+        """
+        with self.inflight_lock:
+            entry = self.inflight.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.inflight_lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del(self.inflight[key])
+
 # -- Requests -------------------------------------------------------------------------------
 
 class TimeoutHTTPAdapter(HTTPAdapter):
@@ -24,7 +181,44 @@ class TimeoutHTTPAdapter(HTTPAdapter):
             kwargs['timeout'] = self.timeout
         return(super().send(request, **kwargs))
 
-def create_session(timeout:int = 5, retry:int = 10):
+class CachingHTTPAdapter(TimeoutHTTPAdapter):
+    """TimeoutHTTPAdapter which serves successful GET & POST responses from a ResponseCache.
+       Streamed requests bypass the cache.
+    """
+    def __init__(self, *args, **kwargs):
+        self.cache = kwargs.pop('cache')
+        super().__init__(*args, **kwargs)
+
+    def build_cached_response(self, request, status, headers, content):
+        response = requests.Response()
+        response.status_code = status
+        response.headers = CaseInsensitiveDict(headers)
+        response._content = content
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response.reason = 'OK'
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        response.from_cache = True
+        return(response)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('stream') or request.method not in ('GET', 'POST'):
+            return(super().send(request, **kwargs))
+
+        key = self.cache.make_key(request.method, request.url, request.body)
+        with self.cache.single_flight(key):
+            cached = self.cache.get(key, request.url)
+            if cached is not None:
+                return(self.build_cached_response(request, *cached))
+
+            response = super().send(request, **kwargs)
+            if response.status_code == 200:
+                self.cache.set(key, request.url, response.status_code, response.headers, response.content)
+            response.from_cache = False
+            return(response)
+
+def create_session(timeout:int = 5, retry:int = 10, cache: ResponseCache = None):
     r = requests.Session()
     
     max_retries = Retry(
@@ -35,7 +229,10 @@ def create_session(timeout:int = 5, retry:int = 10):
             respect_retry_after_header=False
             )
 
-    adapter = TimeoutHTTPAdapter(timeout = timeout, max_retries = max_retries)
+    if cache is None:
+        adapter = TimeoutHTTPAdapter(timeout = timeout, max_retries = max_retries)
+    else:
+        adapter = CachingHTTPAdapter(timeout = timeout, max_retries = max_retries, cache = cache)
     r.mount('https://', adapter)
     r.mount('http://', adapter)
     
@@ -11,6 +11,7 @@ from urllib3.util import Retry
 import asyncio
 from io import BytesIO
 import os
+import time
 
 # -- Related third party imports
 import requests
@@ -80,11 +81,75 @@ def createSession(timeout: int = 5, total_retries:int = 5, proxies = {}, *args:
 
 # -- Async --------------------------------------------------------------------
 
+class TokenBucket():
+    """ Token bucket rate limiter, usable from both sync and async code.
+
+        Tokens refill continuously at `rate` per `period` seconds, up to `capacity`.
+        >>> bucket = TokenBucket(rate = 120, period = 60) # 120 requests per minute
+    """
+    def __init__(self, rate: float, period: float = 60, capacity: float = None):
+        self.rate = rate / period
+        self.capacity = capacity if capacity is not None else max(1, rate / 10)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = None
+        self.loop = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _wait_time(self, tokens: float = 1) -> float:
+        """ Takes `tokens` if available and returns 0, otherwise returns seconds until they will be.
+        """
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return(0)
+        return((tokens - self.tokens) / self.rate)
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """ Returns seconds until `tokens` are available, without taking them.
+        """
+        self._refill()
+        return(max(tokens - self.tokens, 0) / self.rate)
+
+    def take(self, tokens: float = 1) -> None:
+        """ Takes `tokens` at once, e.g. once wait_time found them available.
+        """
+        self._refill()
+        self.tokens -= tokens
+
+    def consume(self, tokens: float = 1) -> None:
+        """ Blocks until `tokens` are available.
+        """
+        wait = self._wait_time(tokens)
+        while wait > 0:
+            time.sleep(wait)
+            wait = self._wait_time(tokens)
+
+    async def acquire(self, tokens: float = 1) -> None:
+        """ Awaits until `tokens` are available, serializing waiters so the bucket is fair.
+        """
+        # asyncio.Lock is bound to an event loop, so recreate it for each new loop (e.g. each asyncio.run)
+        loop = asyncio.get_running_loop()
+        if self.lock is None or self.loop is not loop:
+            self.lock = asyncio.Lock()
+            self.loop = loop
+        async with self.lock:
+            wait = self._wait_time(tokens)
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self._wait_time(tokens)
+
 class AsyncClient():
-    def __init__(self, limit: int = 100, logname: str = 'async.log', proxy = None, verify_ssl: bool = True):
+    def __init__(self, limit: int = 100, logname: str = 'async.log', proxy = None, verify_ssl: bool = True, keep_alive: bool = False):
         self.conn = aiohttp.TCPConnector(limit = limit, limit_per_host = limit, verify_ssl = verify_ssl)
         self.semaphore = asyncio.BoundedSemaphore(value = limit)
-        self.session = aiohttp.ClientSession(connector = self.conn, headers={"Connection": "close"})
+        # Keep-alive lets API clients reuse pooled connections; scrapers default to closing them
+        headers = {} if keep_alive else {"Connection": "close"}
+        self.session = aiohttp.ClientSession(connector = self.conn, headers = headers)
         self.timeout = aiohttp.ClientTimeout(total = 75)
         self.proxy = proxy
 
@@ -95,6 +160,12 @@ class AsyncClient():
         self.formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         self.fh.setFormatter(self.formatter)
         self.logger.addHandler(self.fh)
+
+    async def close(self):
+        await self.session.close()
+        # The logger is shared by every client, so detach this client's handler or each instance leaks a file handle
+        self.logger.removeHandler(self.fh)
+        self.fh.close()
     
     async def get(self, url, response_format = 'BytesIO'):
         data = None
@@ -120,6 +191,9 @@ class AsyncClient():
                         if response.status == 404:
                             await asyncio.sleep(1)
                             data = 1
+                        elif 400 <= response.status < 500 and response.status != 429:
+                            # Other client errors will not succeed on retry
+                            data = 1
                         if response.status == 200:
                             print(e)
                         self.logger.error(f'get ({response.status}): {url}')